@@ -0,0 +1,228 @@
+"""In-process stand-ins for MongoDB (Motor) and Telethon used by the load benchmarks.
+
+FakeCollection keeps documents in a dict and supports the operations forwarder_bot
+issues. FakeTelegram serves channels of FakeMessage objects and accepts sends,
+uploads and downloads with configurable latency, link bandwidth and FloodWait
+probability. Both are deterministic for a given seed. bootstrap_env() gets
+forwarder_bot imported for a benchmark without a real Telegram or MongoDB.
+"""
+import asyncio
+import importlib
+import os
+import random
+import sys
+import tempfile
+import types
+
+from pymongo.errors import BulkWriteError
+from telethon.errors import FloodWaitError
+
+
+def bootstrap_env() -> str:
+    """Imports forwarder_bot with its files in a fresh temp directory and dummy credentials where none are set.
+    Returns the directory; the caller removes it."""
+    work_dir = tempfile.mkdtemp(prefix="forwarder-bench-")
+    for key, value in {"API_ID": "1", "API_HASH": "bench", "BOT_TOKEN": "0:bench", "MONGO_URI": "mongodb://localhost:27017",
+                       "TRANSFER_DIR": os.path.join(work_dir, "transfer"), "MEDIA_CACHE_DIR": os.path.join(work_dir, "cache")}.items():
+        os.environ.setdefault(key, value)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    cwd = os.getcwd(); os.chdir(work_dir)  # the Telethon session file is created on import
+    try: importlib.import_module("forwarder_bot")
+    finally: os.chdir(cwd)
+    return work_dir
+
+
+def matches(doc: dict, query: dict) -> bool:
+    for key, condition in query.items():
+        value = doc.get(key)
+        if isinstance(condition, dict) and any(k.startswith("$") for k in condition):
+            if "$in" in condition and value not in condition["$in"]: return False
+            if "$ne" in condition and value == condition["$ne"]: return False
+            if "$nin" in condition and value in condition["$nin"]: return False
+        elif value != condition: return False
+    return True
+
+
+class FakeCursor:
+    def __init__(self, docs: list[dict]):
+        self.docs = docs
+
+    def sort(self, key: str, direction: int = 1):
+        self.docs.sort(key=lambda d: d.get(key), reverse=direction < 0)
+        return self
+
+    async def to_list(self, length=None):
+        return self.docs[:length] if length else list(self.docs)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self.docs: yield doc
+
+
+class FakeCollection:
+    """A Motor collection with a fixed per-operation latency."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.docs: dict = {}
+        self.operations = 0
+
+    async def _roundtrip(self):
+        self.operations += 1
+        await asyncio.sleep(self.latency)
+
+    def find(self, query: dict | None = None) -> FakeCursor:
+        self.operations += 1
+        return FakeCursor([dict(d) for d in self.docs.values() if matches(d, query or {})])
+
+    async def find_one(self, query: dict):
+        await self._roundtrip()
+        return next((dict(d) for d in self.docs.values() if matches(d, query)), None)
+
+    async def insert_one(self, doc: dict):
+        await self.insert_many([doc])
+
+    async def insert_many(self, docs: list[dict], ordered: bool = True):
+        await self._roundtrip()
+        errors = []
+        for i, doc in enumerate(docs):
+            if doc["_id"] in self.docs:
+                errors.append({"index": i, "code": 11000})
+                if ordered: break
+            else: self.docs[doc["_id"]] = dict(doc)
+        if errors: raise BulkWriteError({"writeErrors": errors})
+
+    def _apply(self, query: dict, update: dict, upsert: bool):
+        doc = next((d for d in self.docs.values() if matches(d, query)), None)
+        if doc is None:
+            if not upsert: return
+            doc = {k: v for k, v in query.items() if not isinstance(v, dict)}
+            doc.setdefault("_id", os.urandom(6).hex()); self.docs[doc["_id"]] = doc
+        for key, value in update.get("$set", {}).items(): doc[key] = value
+        for key, value in update.get("$inc", {}).items(): doc[key] = doc.get(key, 0) + value
+        for key, value in update.get("$max", {}).items(): doc[key] = max(doc.get(key, value), value)
+
+    async def update_one(self, query: dict, update: dict, upsert: bool = False):
+        await self._roundtrip()
+        self._apply(query, update, upsert)
+
+    async def update_many(self, query: dict, update: dict):
+        await self._roundtrip()
+        for doc in [d for d in self.docs.values() if matches(d, query)]: self._apply({"_id": doc["_id"]}, update, False)
+
+    async def bulk_write(self, operations: list, ordered: bool = True):
+        await self._roundtrip()
+        for op in operations: self._apply(op._filter, op._doc, op._upsert)
+
+    async def replace_one(self, query: dict, doc: dict, upsert: bool = False):
+        await self._roundtrip()
+        if upsert or doc["_id"] in self.docs: self.docs[doc["_id"]] = dict(doc)
+
+    async def delete_one(self, query: dict):
+        await self._roundtrip()
+        key = next((k for k, d in self.docs.items() if matches(d, query)), None)
+        if key is not None: del self.docs[key]
+
+    async def delete_many(self, query: dict):
+        await self._roundtrip()
+        for key in [k for k, d in self.docs.items() if matches(d, query)]: del self.docs[key]
+
+
+class FakeMessage:
+    """Enough of telethon's Message for the pipeline: text, optional photo media and album grouping."""
+
+    def __init__(self, telegram, chat_id: int, message_id: int, text: str, media_size: int = 0, grouped_id=None, protected: bool = False):
+        self.telegram, self.chat_id, self.id, self.text, self.message = telegram, chat_id, message_id, text, text
+        self.grouped_id, self.noforwards = grouped_id, protected
+        self.sender_id, self.reply_to, self.action = 1, None, None
+        self.video, self.document = None, None
+        self.photo = types.SimpleNamespace(id=chat_id * 10**7 + message_id, access_hash=0) if media_size else None
+        self.media = self.photo
+        self.file = types.SimpleNamespace(size=media_size, ext=".jpg", mime_type="image/jpeg") if media_size else None
+
+    async def download_media(self, file=None, **kwargs):
+        await self.telegram.transfer(self.file.size)
+        data = bytes(self.file.size)
+        if file is bytes: return data
+        path = file + self.file.ext
+        with open(path, "wb") as f: f.write(data)
+        return path
+
+
+class MessageList(list):
+    total = 0
+
+
+class FakeTelegram:
+    """Stands in for TelegramClient. Every call costs `latency` seconds; media moves over one shared
+    link of `link_bytes_per_second`; sends raise a FloodWait with probability `flood_rate`."""
+
+    def __init__(self, latency: float, link_bytes_per_second: float, flood_rate: float, flood_seconds: int, seed: int = 1):
+        self.latency, self.link_rate = latency, link_bytes_per_second
+        self.flood_rate, self.flood_seconds = flood_rate, flood_seconds
+        self.random = random.Random(seed)
+        self.link = asyncio.Lock()
+        self.channels: dict[int, dict[int, FakeMessage]] = {}
+        self.on_sent = lambda dest_id, caption, parts: None
+        self.sends = self.floods = 0
+
+    async def transfer(self, size: int):
+        await asyncio.sleep(self.latency)
+        async with self.link:
+            await asyncio.sleep(size / self.link_rate)
+
+    async def _request(self):
+        await asyncio.sleep(self.latency)
+        if self.random.random() < self.flood_rate:
+            self.floods += 1
+            raise FloodWaitError(request=None, capture=self.flood_seconds)
+
+    def post(self, chat_id: int, text: str, media_size: int = 0, grouped_id=None, protected: bool = False) -> FakeMessage:
+        channel = self.channels.setdefault(chat_id, {})
+        message = FakeMessage(self, chat_id, len(channel) + 1, text, media_size, grouped_id, protected)
+        channel[message.id] = message
+        return message
+
+    async def get_messages(self, chat_id, ids=None, limit=None, min_id=0, reverse=False):
+        await asyncio.sleep(self.latency)
+        channel = self.channels.get(chat_id, {})
+        if ids is not None:
+            return [channel.get(i) for i in ids] if isinstance(ids, list) else channel.get(ids)
+        newer = [m for i, m in sorted(channel.items(), reverse=not reverse) if i > min_id]
+        result = MessageList(newer[:limit] if limit is not None else newer)
+        result.total = len(channel)
+        return result
+
+    async def upload_file(self, file, **kwargs):
+        size = len(file.getbuffer()) if hasattr(file, "getbuffer") else os.path.getsize(file)
+        await self.transfer(size)
+        return types.SimpleNamespace(kind="uploaded", size=size)
+
+    async def send_file(self, dest_id, file, caption=None, **kwargs):
+        await self._request()
+        self.sends += 1
+        self.on_sent(dest_id, caption, len(file) if isinstance(file, list) else 1)
+        if isinstance(file, list): return [types.SimpleNamespace(id=self.sends, media=types.SimpleNamespace(kind="sent")) for _ in file]
+        return types.SimpleNamespace(id=self.sends, media=types.SimpleNamespace(kind="sent"))
+
+    async def send_message(self, dest_id, text, **kwargs):
+        await self._request()
+        self.sends += 1
+        self.on_sent(dest_id, text, 1)
+        return types.SimpleNamespace(id=self.sends, media=None)
+
+    async def forward_messages(self, dest_id, message_id, from_chat):
+        await self._request()
+        self.sends += 1
+        self.on_sent(dest_id, self.channels[from_chat][message_id].text, 1)
+        return types.SimpleNamespace(id=self.sends)
+
+
+class StatusMessage:
+    """A bot message whose edits are discarded."""
+
+    async def edit_text(self, text, **kwargs):
+        pass
+
@@ -0,0 +1,89 @@
+"""Measures large-file throughput against a local fake Telegram DC.
+
+The fake DC answers part requests after a fixed round-trip time and pushes
+bytes through one shared link of limited bandwidth, so it shows what keeping
+several part requests in flight buys. The parallelism 1 row is the same code
+issuing one part request at a time, which is how Telethon's download_media and
+upload_file move a file; Telethon itself is not measured.
+
+    python benchmarks/large_transfer.py --size-mb 64 --rtt-ms 80 --link-mbps 400
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import time
+import types
+
+from fakes import bootstrap_env
+
+WORK_DIR = bootstrap_env()
+import forwarder_bot  # noqa: E402
+
+
+class FakeDC:
+    """Stands in for the Telethon client: serves GetFile via iter_download and accepts SaveBigFilePart calls."""
+
+    def __init__(self, data: bytes, rtt: float, link_bytes_per_second: float):
+        self.data, self.rtt, self.link_rate = data, rtt, link_bytes_per_second
+        self.link = asyncio.Lock()
+        self.uploaded: dict[int, bytes] = {}
+
+    async def _transfer(self, size: int):
+        await asyncio.sleep(self.rtt)
+        async with self.link:
+            await asyncio.sleep(size / self.link_rate)
+
+    async def iter_download(self, file, offset=0, stride=None, limit=None, request_size=512 * 1024, file_size=None):
+        for i in range(limit):
+            start = offset + i * (stride or request_size)
+            chunk = self.data[start:start + request_size]
+            await self._transfer(len(chunk))
+            yield chunk
+            if len(chunk) < request_size: return
+
+    async def __call__(self, request):
+        await self._transfer(len(request.bytes))
+        self.uploaded[request.file_part] = request.bytes
+        return True
+
+
+async def run(data, path, parallelism, rtt, link_rate):
+    forwarder_bot.TRANSFER_PARALLELISM = parallelism
+    forwarder_bot.client = dc = FakeDC(data, rtt, link_rate)
+    message = types.SimpleNamespace(document=types.SimpleNamespace(size=len(data)))
+
+    start = time.perf_counter()
+    await forwarder_bot.download_parallel(message, path)
+    download = time.perf_counter() - start
+    with open(path, "rb") as f: assert f.read() == data, "downloaded file differs"
+
+    start = time.perf_counter()
+    handle = await forwarder_bot.upload_parallel(path)
+    upload = time.perf_counter() - start
+    assert b"".join(dc.uploaded[i] for i in range(handle.parts)) == data, "uploaded parts differ"
+    return download, upload
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--rtt-ms", type=float, default=80)
+    parser.add_argument("--link-mbps", type=float, default=400, help="shared link bandwidth in megabits per second")
+    parser.add_argument("--parallelism", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    data = os.urandom(args.size_mb * 2**20)
+    size_mb = len(data) / 2**20
+    print(f"{args.size_mb} MB file, {forwarder_bot.TRANSFER_PART_KB} KB parts, {args.rtt_ms:.0f} ms RTT, {args.link_mbps:.0f} Mbit/s link")
+    print(f"{'parallelism':<12} {'download MB/s':>14} {'upload MB/s':>12}")
+    try:
+        for n in args.parallelism:
+            download, upload = await run(data, os.path.join(WORK_DIR, "large.bin"), n, args.rtt_ms / 1000, args.link_mbps * 2**20 / 8)
+            label = f"{n} (serial)" if n == 1 else str(n)
+            print(f"{label:<12} {size_mb / download:>14.1f} {size_mb / upload:>12.1f}")
+    finally: shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
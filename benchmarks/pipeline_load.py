@@ -0,0 +1,261 @@
+"""Load-tests the forwarding pipeline offline and checks it against a baseline.
+
+Drives handle_new_message (live forwarding through the delivery queue, album
+assembly and scheduler), process_album_batch, run_batch (/batch) and
+run_clone_job (/clone) against benchmarks/fakes.py: a fake Telegram with
+configurable latency, link bandwidth, media sizes and FloodWait rate, and
+in-memory Mongo collections.
+
+Reports messages/second, latency percentiles (end-to-end from the NewMessage
+event for live traffic, per-send for the rest), event-loop lag and the
+process's peak RSS so far. --save-baseline records the results;
+--baseline compares against them and exits 1 on a regression beyond --tolerance.
+
+    python benchmarks/pipeline_load.py --baseline benchmarks/baseline.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import shutil
+import sys
+import time
+import types
+
+from fakes import FakeCollection, FakeTelegram, StatusMessage, bootstrap_env
+
+WORK_DIR = bootstrap_env()
+import forwarder_bot  # noqa: E402
+
+# Result fields compared against the baseline, and whether a larger value is better
+CHECKED = {"msg_per_s": True, "p95_ms": False, "loop_lag_p99_ms": False}
+PARAMS = ("messages", "sources", "tasks", "dests", "rate", "album_ratio", "album_size", "media_ratio", "media_kb",
+          "latency_ms", "mongo_latency_ms", "link_mbps", "flood_rate", "flood_seconds", "send_rate", "batch", "clone", "albums", "seed")
+
+
+def percentile(values, q: float) -> float:
+    if isinstance(values, dict): return values[q]
+    if not values: return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class LoopLag:
+    """Samples how late a short sleep wakes up while a scenario runs."""
+
+    def __init__(self, tick: float = 0.005):
+        self.tick, self.samples = tick, []
+
+    async def __aenter__(self):
+        self.task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, *exc):
+        self.task.cancel()
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.tick)
+            self.samples.append(time.perf_counter() - start - self.tick)
+
+
+def result(messages: int, elapsed: float, latencies: list[float], lag: LoopLag) -> dict:
+    p50, p95, p99 = (percentile(latencies, q) for q in (0.5, 0.95, 0.99))
+    return {"msg_per_s": round(messages / elapsed, 1), "messages": messages,
+            "p50_ms": round(p50 * 1000, 1), "p95_ms": round(p95 * 1000, 1), "p99_ms": round(p99 * 1000, 1),
+            "loop_lag_p99_ms": round(percentile(lag.samples, 0.99) * 1000, 1), "loop_lag_max_ms": round(max(lag.samples, default=0) * 1000, 1),
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+
+
+def send_latencies() -> dict:
+    # Per-send latencies from the pipeline's own "deliver" histograms (interpolated within buckets)
+    summary = forwarder_bot.METRICS.quantiles("deliver")
+    return dict(zip((0.5, 0.95, 0.99), summary[1] if summary else (0.0, 0.0, 0.0)))
+
+
+def reset():
+    forwarder_bot.METRICS.histograms.clear(); forwarder_bot.METRICS.errors.clear()
+    forwarder_bot.DEDUP.entries.clear()
+
+
+async def setup(args) -> FakeTelegram:
+    tg = FakeTelegram(args.latency_ms / 1000, args.link_mbps * 2**20 / 8, args.flood_rate, args.flood_seconds, args.seed)
+    forwarder_bot.client, forwarder_bot.MY_ID = tg, 1
+    for name in ("tasks_collection", "stats_collection", "clone_jobs_collection", "queue_collection", "source_state_collection"):
+        setattr(forwarder_bot, name, FakeCollection(args.mongo_latency_ms / 1000))
+    forwarder_bot.QUEUE.collection = forwarder_bot.queue_collection
+    forwarder_bot.SCHEDULER.rate, forwarder_bot.SCHEDULER.burst = args.send_rate, max(1, int(args.send_rate))
+    sources = [-1001000000000 - i for i in range(args.sources)]
+    for t in range(args.tasks):
+        await forwarder_bot.tasks_collection.insert_one({
+            "_id": f"task{t}", "owner_id": 1, "status": "active", "source_ids": sources,
+            "destination_ids": [5000 + t * args.dests + d for d in range(args.dests)],
+            "filters": {}, "modifications": {}, "settings": {"copy_mode": False}})
+    await forwarder_bot.load_task_index()
+    forwarder_bot.SCHEDULER.start()
+    for job in (forwarder_bot.QUEUE.run(), forwarder_bot.QUEUE.dispatch()): forwarder_bot.spawn(job)
+    tg.sources = sources
+    return tg
+
+
+def post_units(tg: FakeTelegram, rng: random.Random, chat_id: int, count: int, prefix: str, args) -> list[list]:
+    """Posts `count` messages to `chat_id` as singles and albums; returns them grouped into send units."""
+    units, posted = [], 0
+    while posted < count:
+        size = args.media_kb * 1024
+        if rng.random() < args.album_ratio:
+            n = min(args.album_size, count - posted)
+            group = rng.getrandbits(62)
+            units.append([tg.post(chat_id, f"{prefix} {posted}" if i == 0 else "", size, group) for i in range(n)])
+        else:
+            units.append([tg.post(chat_id, f"{prefix} {posted}", size if rng.random() < args.media_ratio else 0)])
+        posted += len(units[-1])
+    return units
+
+
+async def live(tg: FakeTelegram, args) -> dict:
+    rng, total_dests = random.Random(args.seed), args.tasks * args.dests
+    units = [(chat_id, unit) for i, chat_id in enumerate(tg.sources)
+             for unit in post_units(tg, rng, chat_id, args.messages // args.sources, f"live {chat_id}", args)]
+    rng.shuffle(units)
+    units.sort(key=lambda item: item[1][0].id)  # each source posts in ID order; sources interleave
+    posted_at, latencies, done = {}, [], asyncio.Event()
+    expected = sum(len(unit) for _, unit in units) * total_dests
+    delivered = 0
+
+    def on_sent(dest_id, caption, parts):
+        nonlocal delivered
+        latencies.append(time.monotonic() - posted_at[caption]); delivered += parts
+        if delivered >= expected: done.set()
+    tg.on_sent = on_sent
+
+    async with LoopLag() as lag:
+        start = time.monotonic()
+        for i, (chat_id, unit) in enumerate(units):
+            if args.rate and (wait := start + i / args.rate - time.monotonic()) > 0: await asyncio.sleep(wait)
+            posted_at[unit[0].text] = time.monotonic()
+            for message in unit: await forwarder_bot.handle_new_message(types.SimpleNamespace(chat_id=chat_id, message=message))
+        try: await asyncio.wait_for(done.wait(), args.timeout)
+        except asyncio.TimeoutError: print(f"  live: only {delivered}/{expected} deliveries within {args.timeout}s")
+        elapsed = time.monotonic() - start
+    return result(delivered, elapsed, latencies, lag)
+
+
+async def albums(tg: FakeTelegram, args) -> dict:
+    rng, chat_id = random.Random(args.seed + 1), -1002000000000
+    album_args = argparse.Namespace(**{**vars(args), "album_ratio": 1.0})
+    units = post_units(tg, rng, chat_id, args.albums * args.album_size, "album", album_args)
+    tasks = [task for task in forwarder_bot.TASK_INDEX[tg.sources[0]]]
+    latencies, delivered, slots = [], 0, asyncio.Semaphore(8)
+
+    def on_sent(dest_id, caption, parts):
+        nonlocal delivered
+        delivered += parts
+    tg.on_sent = on_sent
+
+    async def run(unit):
+        async with slots:
+            started = time.monotonic()
+            await forwarder_bot.process_album_batch(unit, {task.id: (task, {m.id for m in unit}) for task in tasks})
+            latencies.append(time.monotonic() - started)
+
+    async with LoopLag() as lag:
+        start = time.monotonic()
+        await asyncio.gather(*(run(unit) for unit in units))
+        elapsed = time.monotonic() - start
+    return result(delivered, elapsed, latencies, lag)
+
+
+async def batch(tg: FakeTelegram, args) -> dict:
+    chat_id = -1003000000000
+    post_units(tg, random.Random(args.seed + 2), chat_id, args.batch, "batch", args)
+    tracker = forwarder_bot.BackgroundJob(0, 1, "batch", "bench")
+    async with LoopLag() as lag:
+        start = tracker.started = time.monotonic()
+        await forwarder_bot.run_batch(chat_id, 1, args.batch, 6000, StatusMessage(), tracker)
+        elapsed = time.monotonic() - start
+    return result(tracker.sent, elapsed, send_latencies(), lag)
+
+
+async def clone(tg: FakeTelegram, args) -> dict:
+    chat_id = -1004000000000
+    post_units(tg, random.Random(args.seed + 3), chat_id, args.clone, "clone", argparse.Namespace(**{**vars(args), "album_ratio": 0.0}))
+    job = {"_id": "bench", "source_id": chat_id, "dest_id": 7000, "restricted": True, "last_message_id": 0, "copied": 0, "failed": 0}
+    await forwarder_bot.clone_jobs_collection.insert_one(job)
+    tracker = forwarder_bot.BackgroundJob(0, 1, "clone", "bench")
+    async with LoopLag() as lag:
+        start = tracker.started = time.monotonic()
+        await forwarder_bot.run_clone_job(job, StatusMessage(), tracker)
+        elapsed = time.monotonic() - start
+    return result(tracker.sent, elapsed, send_latencies(), lag)
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for scenario, fields in baseline["results"].items():
+        for field, higher_is_better in CHECKED.items():
+            old, new = fields.get(field), results.get(scenario, {}).get(field)
+            if old is None or new is None: continue
+            # Latencies under a few milliseconds are noise on shared machines
+            worse = new < old * (1 - tolerance) if higher_is_better else new > old * (1 + tolerance) + 5
+            if worse: regressions.append(f"{scenario}.{field}: {new} vs baseline {old}")
+    return regressions
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=400, help="live messages, spread over the sources")
+    parser.add_argument("--sources", type=int, default=4)
+    parser.add_argument("--tasks", type=int, default=2, help="tasks, each watching every source")
+    parser.add_argument("--dests", type=int, default=2, help="destinations per task")
+    parser.add_argument("--rate", type=float, default=25, help="live messages per second (0 posts them all at once)")
+    parser.add_argument("--album-ratio", type=float, default=0.1)
+    parser.add_argument("--album-size", type=int, default=4)
+    parser.add_argument("--media-ratio", type=float, default=0.6, help="share of single messages with media")
+    parser.add_argument("--media-kb", type=int, default=256)
+    parser.add_argument("--latency-ms", type=float, default=30, help="Telegram round trip")
+    parser.add_argument("--mongo-latency-ms", type=float, default=2)
+    parser.add_argument("--link-mbps", type=float, default=400, help="media link bandwidth in megabits per second")
+    parser.add_argument("--flood-rate", type=float, default=0.002, help="probability that a send hits a FloodWait")
+    parser.add_argument("--flood-seconds", type=int, default=1)
+    parser.add_argument("--send-rate", type=float, default=200, help="per-chat send rate (SEND_RATE_PER_CHAT)")
+    parser.add_argument("--batch", type=int, default=300, help="messages copied by /batch")
+    parser.add_argument("--clone", type=int, default=200, help="messages copied by /clone")
+    parser.add_argument("--albums", type=int, default=50, help="albums sent through process_album_batch")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--baseline", help="JSON file to compare against")
+    parser.add_argument("--save-baseline", help="write the results to this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression")
+    args = parser.parse_args()
+    forwarder_bot.LOGGER.setLevel(logging.CRITICAL)
+    random.seed(args.seed)  # FloodWait jitter
+
+    tg = await setup(args)
+    results = {}
+    print(f"{'scenario':<10} {'msg/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'lag p99':>8} {'lag max':>8} {'RSS MB':>7}")
+    for name, scenario in (("live", live), ("albums", albums), ("batch", batch), ("clone", clone)):
+        reset()
+        r = results[name] = await scenario(tg, args)
+        print(f"{name:<10} {r['msg_per_s']:>8.1f} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} {r['loop_lag_p99_ms']:>8.1f} {r['loop_lag_max_ms']:>8.1f} {r['peak_rss_mb']:>7.1f}")
+    print(f"{tg.sends} sends, {tg.floods} FloodWaits injected")
+
+    params = {name: getattr(args, name) for name in PARAMS}
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f: json.dump({"params": params, "results": results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f: baseline = json.load(f)
+        if baseline["params"] != params: sys.exit(f"{args.baseline} was recorded with different parameters: {baseline['params']}")
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions: print(f"REGRESSION {line}")
+        if regressions: sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    try: asyncio.run(main())
+    finally: shutil.rmtree(WORK_DIR, ignore_errors=True)
@@ -0,0 +1,79 @@
+"""Measures how long thumbnail generation stalls the asyncio event loop.
+
+Runs forwarder_bot.extract_thumbnail inline on the loop (the old
+implementation) and through forwarder_bot.generate_thumbnail (thread pool),
+so only where the extraction runs differs. Wall time is reported next to
+the stalls.
+
+    python benchmarks/thumbnail_stall.py --videos 8 --frames 300
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import time
+
+import cv2
+import numpy as np
+
+from fakes import bootstrap_env
+
+WORK_DIR = bootstrap_env()
+import forwarder_bot  # noqa: E402
+
+
+def make_video(path, frames, size=(1280, 720)):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), 30, size)
+    frame = np.random.randint(0, 255, (size[1], size[0], 3), dtype=np.uint8)
+    for i in range(frames):
+        writer.write(np.roll(frame, i * 8, axis=1))
+    writer.release()
+
+
+async def inline_thumbnail(video_path):
+    # The pre-thread-pool implementation: the same extraction, run on the event loop.
+    thumb_path = os.path.splitext(video_path)[0] + ".jpg"
+    return thumb_path if forwarder_bot.extract_thumbnail(video_path, thumb_path) else None
+
+
+async def measure(thumbnailer, videos, tick=0.005):
+    stalls, done = [], asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(tick)
+            stalls.append(time.perf_counter() - start - tick)
+
+    ticker_task = asyncio.create_task(ticker())
+    start = time.perf_counter()
+    for path in await asyncio.gather(*(thumbnailer(v) for v in videos)):
+        if path and os.path.exists(path): os.remove(path)
+    elapsed = time.perf_counter() - start
+    done.set(); await ticker_task
+    stalls.sort()
+    return elapsed, stalls[-1], stalls[int(len(stalls) * 0.99) - 1] if stalls else 0.0
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--videos", type=int, default=8)
+    parser.add_argument("--frames", type=int, default=300)
+    args = parser.parse_args()
+
+    try:
+        videos = []
+        for i in range(args.videos):
+            videos.append(os.path.join(WORK_DIR, f"bench_{i}.mp4")); make_video(videos[-1], args.frames)
+        print(f"{args.videos} videos, THUMB_WORKERS={forwarder_bot.THUMB_WORKERS}")
+        print(f"{'implementation':<14} {'wall (s)':>9} {'vs inline':>10} {'max stall (ms)':>15} {'p99 stall (ms)':>15}")
+        inline_elapsed = None
+        for name, fn in (("inline", inline_thumbnail), ("thread pool", forwarder_bot.generate_thumbnail)):
+            elapsed, worst, p99 = await measure(fn, videos)
+            inline_elapsed = inline_elapsed or elapsed
+            print(f"{name:<14} {elapsed:>9.2f} {elapsed / inline_elapsed:>9.1f}x {worst * 1000:>15.1f} {p99 * 1000:>15.1f}")
+    finally: shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,12 +1,18 @@
 import asyncio
+import atexit
+import io
 import os
 import re
 import random
 import logging
+import shutil
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+STARTUP_BEGAN = time.perf_counter()  # before the third-party imports, which dominate module load
 from dotenv import load_dotenv
-import cv2
-from PIL import Image
-from telethon import TelegramClient, events
+from telethon import TelegramClient, events, utils
 from telethon.tl.types import Message
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
@@ -18,7 +24,7 @@ from telegram.ext import (
     CallbackQueryHandler,
     ConversationHandler,
 )
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
 
 # --- LOGGING SETUP ---
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
@@ -29,12 +35,21 @@ load_dotenv()
 API_ID, API_HASH, BOT_TOKEN, MONGO_URI = os.getenv("API_ID"), os.getenv("API_HASH"), os.getenv("BOT_TOKEN"), os.getenv("MONGO_URI")
 SESSION_NAME = "telegram_forwarder"
 MY_ID = None
+THUMB_WORKERS = int(os.getenv("THUMB_WORKERS", "2"))
+THUMB_TIMEOUT = float(os.getenv("THUMB_TIMEOUT", "20"))
+THUMB_POOL = ThreadPoolExecutor(max_workers=THUMB_WORKERS, thread_name_prefix="thumb")
+# Media up to TRANSFER_MEMORY_MAX_MB is held in memory; larger files are spooled under TRANSFER_DIR
+TRANSFER_DIR = os.getenv("TRANSFER_DIR", "transfer_tmp")
+TRANSFER_MEMORY_MAX_MB = float(os.getenv("TRANSFER_MEMORY_MAX_MB", "20"))
+# "tasks" checks only the chats active tasks use, "dialogs" walks every dialog, "off" skips warm-up
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "tasks")
+ENTITY_TTL_SECONDS = float(os.getenv("ENTITY_TTL_SECONDS", "3600"))
 if not all([API_ID, API_HASH, BOT_TOKEN, MONGO_URI]):
     raise RuntimeError("API credentials and MONGO_URI must be set in .env file.")
 
 # --- DATABASE SETUP ---
 try:
-    mongo_client = MongoClient(MONGO_URI)
+    mongo_client = AsyncIOMotorClient(MONGO_URI)
     db = mongo_client.forwarder_bot
     tasks_collection = db.tasks
     LOGGER.info("Successfully connected to MongoDB.")
@@ -54,24 +69,99 @@ def create_beautiful_caption(original_text):
     caption_parts = [f"Watch Full Videos {emojis[0]}{emojis[1]}"] + [f"V{i}:\n{link}" for i, link in enumerate(links, 1)]
     return "\n\n".join(caption_parts)
 
-async def generate_thumbnail(video_path):
-    thumb_path = None
+def extract_thumbnail(video_path: str, thumb_path: str | io.BytesIO) -> bool:
+    # Runs in THUMB_POOL. Seeks ~10% into the video to skip black intro frames.
+    # OpenCV and PIL are imported on first use so they don't slow down startup.
+    import cv2
+    from PIL import Image
+    cap = cv2.VideoCapture(video_path)
     try:
-        thumb_path = os.path.splitext(video_path)[0] + ".jpg"
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened(): return None
+        if not cap.isOpened(): return False
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        if frame_count > 1: cap.set(cv2.CAP_PROP_POS_FRAMES, frame_count // 10)
         ret, frame = cap.read()
-        if not ret: cap.release(); return None
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        img = Image.fromarray(frame_rgb)
+        if not ret and frame_count > 1: cap.set(cv2.CAP_PROP_POS_FRAMES, 0); ret, frame = cap.read()
+        if not ret: return False
+        img = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
         img.thumbnail((320, 320))
         img.save(thumb_path, "JPEG")
+        return True
+    finally:
         cap.release()
-        return thumb_path
+
+def extract_thumbnail_from_buffer(data: bytes) -> bytes | None:
+    # OpenCV only decodes files, so the video is spilled to the private transfer directory while it reads
+    with tempfile.NamedTemporaryFile(dir=TRANSFER.directory, suffix=".mp4") as video:
+        video.write(data); video.flush()
+        thumb = io.BytesIO()
+        return thumb.getvalue() if extract_thumbnail(video.name, thumb) else None
+
+async def generate_thumbnail(video_path):
+    """Returns a JPEG thumbnail for the video at `video_path`: a file next to it, or
+    bytes when `video_path` is an in-memory buffer from TRANSFER.download()."""
+    if isinstance(video_path, io.BytesIO):
+        future = THUMB_POOL.submit(extract_thumbnail_from_buffer, video_path.getvalue())
+        try: return await asyncio.wait_for(asyncio.wrap_future(future), THUMB_TIMEOUT)
+        except asyncio.TimeoutError: LOGGER.warning(f"Thumbnail generation timed out after {THUMB_TIMEOUT}s: {video_path.name}")
+        except Exception as e: LOGGER.error(f"Thumbnail generation failed: {e}")
+        return None
+    thumb_path = os.path.splitext(video_path)[0] + ".jpg"
+    future = THUMB_POOL.submit(extract_thumbnail, video_path, thumb_path)
+    try:
+        if await asyncio.wait_for(asyncio.wrap_future(future), THUMB_TIMEOUT): return thumb_path
+    except asyncio.TimeoutError:
+        LOGGER.warning(f"Thumbnail generation timed out after {THUMB_TIMEOUT}s: {video_path}")
+        # The worker thread can't be interrupted; drop its output once it finishes
+        future.add_done_callback(lambda _: os.path.exists(thumb_path) and os.remove(thumb_path))
+        return None
     except Exception as e:
         LOGGER.error(f"Thumbnail generation failed: {e}")
-        if thumb_path and os.path.exists(thumb_path): os.remove(thumb_path)
-        return None
+    if os.path.exists(thumb_path): os.remove(thumb_path)
+    return None
+
+# --- MEDIA TRANSFER ---
+# Downloads that fit in TRANSFER_MEMORY_MAX_MB go into a BytesIO and never touch
+# disk. Larger ones get a unique name in a per-process directory under
+# TRANSFER_DIR; directories left behind by a process that died are removed on startup.
+class TransferSpool:
+    def __init__(self, base_dir: str, memory_max_bytes: int):
+        self.memory_max_bytes = memory_max_bytes
+        os.makedirs(base_dir, exist_ok=True)
+        for item in os.scandir(base_dir):
+            if item.is_dir() and not self.pid_alive(item.name): shutil.rmtree(item.path, ignore_errors=True)
+        self.directory = os.path.join(base_dir, str(os.getpid()))
+        os.makedirs(self.directory, exist_ok=True)
+        atexit.register(shutil.rmtree, self.directory, True)
+
+    @staticmethod
+    def pid_alive(name: str) -> bool:
+        try: os.kill(int(name), 0)
+        except (ValueError, ProcessLookupError): return False
+        except PermissionError: pass
+        return True
+
+    def fits_in_memory(self, message: Message) -> bool:
+        size = message.file.size if message.file else None
+        return size is not None and size <= self.memory_max_bytes
+
+    async def download(self, message: Message) -> io.BytesIO | str | None:
+        """Downloads `message`'s media into a named BytesIO or a private temp file; see release()."""
+        if not self.fits_in_memory(message):
+            # Telethon appends the media's extension
+            return await message.download_media(file=os.path.join(self.directory, uuid.uuid4().hex))
+        data = await message.download_media(file=bytes)
+        if not data: return None
+        buffer = io.BytesIO(data)
+        buffer.name = f"{message.id}{message.file.ext or ''}"  # lets Telethon pick the MIME type and attributes
+        return buffer
+
+    @staticmethod
+    def release(*items):
+        for item in items:
+            if isinstance(item, io.BytesIO): item.close()
+            elif isinstance(item, str) and os.path.exists(item): os.remove(item)
+
+TRANSFER = TransferSpool(TRANSFER_DIR, int(TRANSFER_MEMORY_MAX_MB * 2**20))
 
 # --- ALBUM/SINGLE MEDIA HANDLING ---
 ALBUM_HANDLING_TASKS = {}
@@ -80,7 +170,7 @@ async def process_single_message(dest_id: int, message: Message, caption: str):
     path, thumb_path = None, None
     try:
         if message.media:
-            path = await message.download_media(file=f"temp_single_{message.id}")
+            path = await TRANSFER.download(message)
             if message.video:
                 thumb_path = await generate_thumbnail(path)
         LOGGER.info(f"Copying single message {message.id} to {dest_id}")
@@ -88,8 +178,7 @@ async def process_single_message(dest_id: int, message: Message, caption: str):
     except Exception as e:
         LOGGER.error(f"Failed to copy single message to {dest_id}: {e}")
     finally:
-        if path and os.path.exists(path): os.remove(path)
-        if thumb_path and os.path.exists(thumb_path): os.remove(thumb_path)
+        TRANSFER.release(path, thumb_path)
 
 async def process_album(task_id, group_id, dest_ids, caption):
     await asyncio.sleep(3)
@@ -98,8 +187,8 @@ async def process_album(task_id, group_id, dest_ids, caption):
     if not messages: return
     paths, thumb_path = [], None
     try:
-        for i, msg in enumerate(messages):
-            path = await msg.download_media(file=f"temp_{task_id}_{group_id}_{i}")
+        for msg in messages:
+            path = await TRANSFER.download(msg)
             paths.append(path)
             if not thumb_path and msg.video:
                 thumb_path = await generate_thumbnail(path)
@@ -108,9 +197,7 @@ async def process_album(task_id, group_id, dest_ids, caption):
     except Exception as e:
         LOGGER.error(f"Error processing album {group_id}: {e}")
     finally:
-        for path in paths:
-            if os.path.exists(path): os.remove(path)
-        if thumb_path and os.path.exists(thumb_path): os.remove(thumb_path)
+        TRANSFER.release(*paths, thumb_path)
 
 # --- TELETHON CLIENT ENGINE ---
 client = TelegramClient(SESSION_NAME, int(API_ID), API_HASH)
@@ -119,8 +206,7 @@ client = TelegramClient(SESSION_NAME, int(API_ID), API_HASH)
 async def handle_new_message(event):
     if not MY_ID: return
     message = event.message
-    active_tasks = tasks_collection.find({"source_ids": event.chat_id, "status": "active"})
-    for task in active_tasks:
+    async for task in tasks_collection.find({"source_ids": event.chat_id, "status": "active"}):
         filters_doc = task.get("filters", {}); msg_text = message.text or ""
         if (filters_doc.get("block_photos") and message.photo) or \
            (filters_doc.get("block_videos") and message.video) or \
@@ -159,7 +245,7 @@ async def handle_new_message(event):
 
 async def forward_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, from_cancel=False):
     user_id = update.effective_user.id
-    tasks = list(tasks_collection.find({"owner_id": user_id}))
+    tasks = await tasks_collection.find({"owner_id": user_id}).to_list(None)
     buttons = [[InlineKeyboardButton(f"{'✅' if t.get('status') == 'active' else '❌'} {t['_id']}", callback_data=f"toggle_status:{t['_id']}"),
                 InlineKeyboardButton("⚙️ Settings", callback_data=f"settings_menu:{t['_id']}"),
                 InlineKeyboardButton("🗑️", callback_data=f"delete_confirm:{t['_id']}")] for t in tasks]
@@ -187,9 +273,9 @@ async def save_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         message = await client.get_messages(chat_id, ids=msg_id)
         if not message: await status_msg.edit_text("Could not fetch message."); return
         
-        # Step 2: Download media to a temporary file on disk
+        # Step 2: Download media into memory, or a private temp file if it's large
         if message.media:
-            path = await message.download_media(file=f"temp_save_{message.id}")
+            path = await TRANSFER.download(message)
             if message.video:
                 thumb_path = await generate_thumbnail(path)
 
@@ -210,56 +296,59 @@ async def save_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         LOGGER.error(f"Error in /save command: {e}")
     finally:
         # Step 4: Clean up temporary files
-        if path and os.path.exists(path): os.remove(path)
-        if thumb_path and os.path.exists(thumb_path): os.remove(thumb_path)
+        TRANSFER.release(path, thumb_path)
 
 async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query; await query.answer()
     action, _, value = query.data.partition(':'); user_id = update.effective_user.id
     if action == "toggle_status":
-        task = tasks_collection.find_one({"_id": value, "owner_id": user_id})
-        if task: tasks_collection.update_one({"_id": value}, {"$set": {"status": "stopped" if task.get('status') == 'active' else 'active'}})
+        task = await tasks_collection.find_one({"_id": value, "owner_id": user_id})
+        if task: await tasks_collection.update_one({"_id": value}, {"$set": {"status": "stopped" if task.get('status') == 'active' else 'active'}})
         return await forward_command_handler(update, context)
     elif action == "delete_confirm":
         keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("✅ Yes, Delete", callback_data=f"delete_execute:{value}")], [InlineKeyboardButton("❌ Cancel", callback_data="back_to_main_menu")]])
         await query.edit_message_text(f"Are you sure you want to delete task '{value}'?", reply_markup=keyboard); return MAIN_MENU
     elif action == "delete_execute":
-        tasks_collection.delete_one({"_id": value, "owner_id": user_id})
+        await tasks_collection.delete_one({"_id": value, "owner_id": user_id})
         await query.edit_message_text(f"Task '{value}' has been deleted."); await asyncio.sleep(2)
         return await forward_command_handler(update, context)
     elif query.data == "back_to_main_menu":
         return await forward_command_handler(update, context)
     elif action == "settings_toggle_beautify" or action == "settings_toggle_filter":
         task_id, filter_type = value.split(":")
-        task = tasks_collection.find_one({"_id": task_id, "owner_id": user_id})
+        task = await tasks_collection.find_one({"_id": task_id, "owner_id": user_id})
         if task:
             db_field = "modifications.beautiful_captions" if "beautify" in action else f"filters.{filter_type}"
             current_status = task.get("modifications", {}).get("beautiful_captions", False) if "beautify" in action else task.get("filters", {}).get(filter_type, False)
-            tasks_collection.update_one({"_id": task_id}, {"$set": {db_field: not current_status}})
+            await tasks_collection.update_one({"_id": task_id}, {"$set": {db_field: not current_status}})
         context.user_data['current_task_id'] = task_id
         return await show_settings_menu(update, context)
     elif action == "settings_menu":
         context.user_data['current_task_id'] = value
         return await show_settings_menu(update, context)
 
+CHAT_TITLES = {}  # chat_id -> (expires_at, title); failed lookups are retried after a minute
+
+async def get_chat_title(chat_id) -> str:
+    cached = CHAT_TITLES.get(chat_id)
+    if cached and cached[0] > time.monotonic(): return cached[1]
+    try: title, ttl = (await client.get_entity(chat_id)).title, ENTITY_TTL_SECONDS
+    except Exception: title, ttl = "Unknown Chat", 60
+    CHAT_TITLES[chat_id] = (time.monotonic() + ttl, title)
+    return title
+
 async def get_chat_titles(ids: list) -> str:
-    titles = []
-    for chat_id in ids:
-        try:
-            entity = await client.get_entity(chat_id)
-            titles.append(f"{entity.title} (`{chat_id}`)")
-        except Exception: titles.append(f"Unknown Chat (`{chat_id}`)")
-    return "\n".join(titles)
+    titles = await asyncio.gather(*(get_chat_title(chat_id) for chat_id in ids))
+    return "\n".join(f"{title} (`{chat_id}`)" for chat_id, title in zip(ids, titles))
 
 async def show_settings_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     task_id = context.user_data.get('current_task_id')
-    task = tasks_collection.find_one({"_id": task_id})
+    task = await tasks_collection.find_one({"_id": task_id})
     if not task: await update.callback_query.edit_message_text("Error: Task not found."); return MAIN_MENU
     mods = task.get("modifications", {}); filters_doc = task.get("filters", {})
     beautify_emoji = "✅" if mods.get("beautiful_captions") else "❌"
     def f_emoji(f_type): return "✅" if filters_doc.get(f_type) else "❌"
-    source_info = await get_chat_titles(task.get('source_ids', []))
-    dest_info = await get_chat_titles(task.get('destination_ids', []))
+    source_info, dest_info = await asyncio.gather(get_chat_titles(task.get('source_ids', [])), get_chat_titles(task.get('destination_ids', [])))
     text = (f"*Settings for task: {task_id}*\n\n"
             f"Source(s):\n{source_info}\n\n"
             f"Destination(s):\n{dest_info}")
@@ -281,7 +370,7 @@ async def new_task_start(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     await update.callback_query.edit_message_text("Please provide a unique name for this task.\n\nOr /cancel."); return ASK_LABEL
 async def get_label(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     label = update.message.text.strip()
-    if tasks_collection.find_one({"_id": label}): await update.message.reply_text("Label exists. Try another or /cancel."); return ASK_LABEL
+    if await tasks_collection.find_one({"_id": label}): await update.message.reply_text("Label exists. Try another or /cancel."); return ASK_LABEL
     context.user_data['new_task_label'] = label; await update.message.reply_text("✅ Label set. Send Source ID(s) or forward a message.\n\nOr /cancel."); return ASK_SOURCE
 async def get_source(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     ids = [update.message.forward_origin.chat.id] if update.message.forward_origin else parse_chat_ids(update.message.text)
@@ -290,7 +379,7 @@ async def get_source(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 async def get_destination(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     ids = [update.message.forward_origin.chat.id] if update.message.forward_origin else parse_chat_ids(update.message.text)
     if not ids: await update.message.reply_text("Invalid ID. Send numeric IDs or forward a message. Or /cancel."); return ASK_DESTINATION
-    tasks_collection.insert_one({"_id": context.user_data['new_task_label'], "owner_id": update.effective_user.id, "status": "active",
+    await tasks_collection.insert_one({"_id": context.user_data['new_task_label'], "owner_id": update.effective_user.id, "status": "active",
         "source_ids": context.user_data['new_task_source'], "destination_ids": ids,
         "modifications": {"footer_text": None, "replace_rules": None, "remove_texts": None, "beautiful_captions": False}, 
         "filters": {"blacklist_words": None, "whitelist_words": None, "block_photos": False, "block_videos": False, "block_documents": False, "block_text": False},
@@ -313,7 +402,7 @@ async def save_setting_text(update: Update, context: ContextTypes.DEFAULT_TYPE,
     task_id = context.user_data.get('current_task_id')
     if not task_id: return ConversationHandler.END
     new_value = update.message.text if update.message.text.lower() != '/skip' else None
-    tasks_collection.update_one({"_id": task_id}, {"$set": {db_key_path: new_value}})
+    await tasks_collection.update_one({"_id": task_id}, {"$set": {db_key_path: new_value}})
     await update.message.reply_text("✅ Setting updated!"); await forward_command_handler(update, context)
     return ConversationHandler.END
 async def get_footer(update: Update, context: ContextTypes.DEFAULT_TYPE): return await save_setting_text(update, context, "modifications.footer_text")
@@ -359,8 +448,8 @@ async def get_batch_destination(update: Update, context: ContextTypes.DEFAULT_TY
                 album = [m for m in existing_messages[i:] if m and m.grouped_id == message.grouped_id]
                 album_paths, thumb_path = [], None
                 try:
-                    for j, msg in enumerate(album):
-                        path = await msg.download_media(file=f"temp_batch_{msg.id}_{j}")
+                    for msg in album:
+                        path = await TRANSFER.download(msg)
                         album_paths.append(path)
                         if not thumb_path and msg.video:
                             thumb_path = await generate_thumbnail(path)
@@ -369,9 +458,7 @@ async def get_batch_destination(update: Update, context: ContextTypes.DEFAULT_TY
                 except Exception as e:
                     LOGGER.error(f"Batch album copy error for group {message.grouped_id}: {e}"); errors += len(album)
                 finally:
-                    for path in album_paths:
-                        if os.path.exists(path): os.remove(path)
-                    if thumb_path and os.path.exists(thumb_path): os.remove(thumb_path)
+                    TRANSFER.release(*album_paths, thumb_path)
                 i += len(album)
             else:
                 await process_single_message(dest_id, message, message.text)
@@ -382,8 +469,34 @@ async def get_batch_destination(update: Update, context: ContextTypes.DEFAULT_TY
         await status_msg.edit_text(f"A critical error during batch: {e}"); return ConversationHandler.END
     await status_msg.edit_text(f"✅ Batch complete!\n\nSuccess: {count}\nFailed: {errors}"); return ConversationHandler.END
 
+async def warm_up_entities():
+    """Makes sure the session can resolve every chat active tasks use; see STARTUP_WARMUP."""
+    if STARTUP_WARMUP == "off": return
+    if STARTUP_WARMUP == "dialogs":
+        async for _ in client.iter_dialogs(): pass
+        return
+    chat_ids = set()
+    async for doc in tasks_collection.find({"status": "active"}, {"source_ids": 1, "destination_ids": 1}):
+        chat_ids.update(doc.get("source_ids", []) + doc.get("destination_ids", []))
+    chat_ids = list(chat_ids)
+
+    async def in_session(chat_id) -> bool:
+        # Answered from the access hashes Telethon persists in the session file; only usernames cost an API call
+        try: await client.get_input_entity(chat_id); return True
+        except Exception: return False
+
+    found = await asyncio.gather(*(in_session(chat_id) for chat_id in chat_ids))
+    # Anything the session doesn't know is looked for in the dialog list, walked only as far as needed
+    missing = {utils.resolve_id(chat_id)[0] for chat_id, ok in zip(chat_ids, found) if not ok and isinstance(chat_id, int)}
+    if missing:
+        async for dialog in client.iter_dialogs():
+            missing.discard(utils.resolve_id(dialog.id)[0])
+            if not missing: break
+    LOGGER.info(f"Entity warm-up: {len(chat_ids)} task chats, {found.count(False)} not in session, {len(missing)} unresolved.")
+
 async def main():
     global MY_ID
+    loaded = time.perf_counter()
     application = (Application.builder().token(BOT_TOKEN).connect_timeout(30).read_timeout(30).write_timeout(60).build())
     cancel_handler = CommandHandler('cancel', cancel)
     conv_handler = ConversationHandler(
@@ -414,12 +527,13 @@ async def main():
     application.add_handler(CommandHandler("save", save_command)); application.add_handler(CommandHandler("start", forward_command_handler))
     
     LOGGER.info("Control Bot starting..."); await application.initialize(); await application.start(); await application.updater.start_polling(); LOGGER.info("Control Bot started.")
-    await client.start(); me = await client.get_me(); MY_ID = me.id; LOGGER.info(f"Telethon client started as: {me.first_name} (ID: {MY_ID})")
-    LOGGER.info("Warming up Telethon client and fetching dialogs...");
-    try:
-        async for _ in client.iter_dialogs(): pass
-        LOGGER.info("Dialogs fetched successfully.")
-    except Exception as e: LOGGER.warning(f"Could not pre-fetch dialogs: {e}")
+    await client.start(); me = await client.get_me(); connected = time.perf_counter()
+    LOGGER.info("Warming up Telethon client...")
+    try: await warm_up_entities()
+    except Exception as e: LOGGER.warning(f"Could not warm up entities: {e}")
+    MY_ID = me.id; LOGGER.info(f"Telethon client started as: {me.first_name} (ID: {MY_ID})")
+    ready = time.perf_counter()
+    LOGGER.info(f"Startup: ready in {ready - STARTUP_BEGAN:.2f}s (module load {loaded - STARTUP_BEGAN:.2f}s, logins {connected - loaded:.2f}s, entity warm-up {ready - connected:.2f}s)")
     await client.run_until_disconnected(); await application.updater.stop(); await application.stop()
 
 if __name__ == "__main__":
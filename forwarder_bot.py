@@ -1,17 +1,34 @@
 import asyncio
+import atexit
+import bisect
+import cProfile
+import hashlib
+import io
 import os
 import re
 import random
 import logging
+import marshal
+import pstats
+import shutil
+import signal
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import time
+from collections import Counter, OrderedDict, deque
+STARTUP_BEGAN = time.perf_counter()  # before the third-party imports, which dominate module load
 from dotenv import load_dotenv
-import cv2
-from PIL import Image
-from telethon import TelegramClient, events
-from telethon.tl.types import Message, DocumentAttributeVideo
-from telethon.errors import FloodWaitError
+from telethon import TelegramClient, events, functions, utils
+from telethon.sessions import StringSession
+from telethon.tl.types import Message, ChannelForbidden, ChatForbidden, DocumentAttributeVideo, InputFileBig, MessageMediaWebPage
+from telethon.errors import ChatForwardsRestrictedError, FloodError, FloodWaitError, SlowModeWaitError, TimedOutError
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler, ConversationHandler
-from pymongo import MongoClient
+from telegram.ext import Application, ApplicationHandlerStop, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler, ConversationHandler
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
 from datetime import datetime
 
 # Enable logging
@@ -25,6 +42,66 @@ API_HASH = os.getenv("API_HASH")
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 MONGO_URI = os.getenv("MONGO_URI")
 SESSION_NAME = "telegram_forwarder"
+# Extra logged-in accounts that share the sending load, comma-separated: each is a Telethon session file name
+# if that file exists, otherwise a StringSession. More can be stored in Mongo
+SESSION_POOL = [entry.strip() for entry in os.getenv("SESSION_POOL", "").split(",") if entry.strip()]
+SESSION_RING_REPLICAS = int(os.getenv("SESSION_RING_REPLICAS", "64"))
+# How often the pool re-checks which accounts are still members of each source
+SESSION_CHECK_SECONDS = int(os.getenv("SESSION_CHECK_SECONDS", "300"))
+SEND_WORKERS = int(os.getenv("SEND_WORKERS", "8"))
+SEND_RATE_PER_CHAT = float(os.getenv("SEND_RATE_PER_CHAT", "1"))
+SEND_BURST_PER_CHAT = int(os.getenv("SEND_BURST_PER_CHAT", "3"))
+# FloodWaits are surfaced to BackoffController instead of being slept inside Telethon, so every request goes through BACKOFF
+FLOOD_SLEEP_THRESHOLD = int(os.getenv("FLOOD_SLEEP_THRESHOLD", "0"))
+FLOOD_CHAT_MAX_SECONDS = int(os.getenv("FLOOD_CHAT_MAX_SECONDS", "30"))
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "5"))
+RETRY_MAX_BACKOFF = float(os.getenv("RETRY_MAX_BACKOFF", "60"))
+# OpenCV and PIL release the GIL while decoding/encoding, so a small thread pool keeps the loop free
+THUMB_WORKERS = int(os.getenv("THUMB_WORKERS", "2"))
+THUMB_TIMEOUT = float(os.getenv("THUMB_TIMEOUT", "20"))
+THUMB_POOL = ThreadPoolExecutor(max_workers=THUMB_WORKERS, thread_name_prefix="thumb")
+# Media up to TRANSFER_MEMORY_MAX_MB is held in memory, TRANSFER_MEMORY_BUDGET_MB in all (the rest is spooled under
+# TRANSFER_DIR), and the most recent TRANSFER_MEMORY_CACHE_MB of it is kept for reuse; larger media uses MEDIA_CACHE_DIR
+TRANSFER_DIR = os.getenv("TRANSFER_DIR", "transfer_tmp")
+TRANSFER_MEMORY_MAX_MB = float(os.getenv("TRANSFER_MEMORY_MAX_MB", "20"))
+TRANSFER_MEMORY_BUDGET_MB = float(os.getenv("TRANSFER_MEMORY_BUDGET_MB", "256"))
+TRANSFER_MEMORY_CACHE_MB = float(os.getenv("TRANSFER_MEMORY_CACHE_MB", "64"))
+# Files of LARGE_FILE_MB and up are transferred as TRANSFER_PART_KB parts (a divisor of 512, multiple of 4)
+LARGE_FILE_MB = int(os.getenv("LARGE_FILE_MB", "64"))
+TRANSFER_PART_KB = int(os.getenv("TRANSFER_PART_KB", "512"))
+TRANSFER_PARALLELISM = int(os.getenv("TRANSFER_PARALLELISM", "4"))
+# Copy mode re-sends media by reference: no download, but also no generated thumbnail; tasks toggle it in their settings
+COPY_MODE_DEFAULT = os.getenv("COPY_MODE_DEFAULT", "false").lower() in ("1", "true", "yes")
+MEDIA_CACHE_DIR = os.getenv("MEDIA_CACHE_DIR", "media_cache")
+MEDIA_CACHE_MAX_MB = int(os.getenv("MEDIA_CACHE_MAX_MB", "2048"))  # 0 disables the cache
+ALBUM_QUIET_SECONDS = float(os.getenv("ALBUM_QUIET_SECONDS", "1.0"))
+ALBUM_MAX_WAIT = float(os.getenv("ALBUM_MAX_WAIT", "10"))
+STATS_FLUSH_SECONDS = float(os.getenv("STATS_FLUSH_SECONDS", "5"))
+STATS_FLUSH_EVENTS = int(os.getenv("STATS_FLUSH_EVENTS", "200"))
+CLONE_PAGE_SIZE = int(os.getenv("CLONE_PAGE_SIZE", "100"))
+BATCH_FETCH_CHUNK = int(os.getenv("BATCH_FETCH_CHUNK", "100"))
+BATCH_DOWNLOADS = int(os.getenv("BATCH_DOWNLOADS", "4"))
+PROGRESS_EDIT_SECONDS = float(os.getenv("PROGRESS_EDIT_SECONDS", "10"))
+JOBS_PER_USER = int(os.getenv("JOBS_PER_USER", "2"))  # /batch, /clone and link saves running at once per user
+QUEUE_MAX_INFLIGHT = int(os.getenv("QUEUE_MAX_INFLIGHT", "256"))
+QUEUE_MAX_ATTEMPTS = int(os.getenv("QUEUE_MAX_ATTEMPTS", "3"))
+# Catch-up after downtime: messages queued per second, paused while more than BACKFILL_MAX_BACKLOG jobs are in flight
+BACKFILL_RATE = float(os.getenv("BACKFILL_RATE", "5"))
+BACKFILL_MAX_BACKLOG = int(os.getenv("BACKFILL_MAX_BACKLOG", "100"))
+# "tasks" checks only the chats active tasks use, "dialogs" walks every dialog, "off" skips warm-up
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "tasks")
+ENTITY_TTL_SECONDS = float(os.getenv("ENTITY_TTL_SECONDS", "3600"))
+ENTITY_CONCURRENCY = int(os.getenv("ENTITY_CONCURRENCY", "8"))
+FILTER_WORD_MAX_CHARS = int(os.getenv("FILTER_WORD_MAX_CHARS", "200"))  # longest blacklist/whitelist entry the menu accepts
+DEDUP_TTL_HOURS = float(os.getenv("DEDUP_TTL_HOURS", "24"))
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", "100000"))  # 0 disables duplicate suppression
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))  # 0 disables the /metrics endpoint
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "1"))  # seconds between event-loop lag samples; 0 disables
+LOOP_LAG_WARN_MS = float(os.getenv("LOOP_LAG_WARN_MS", "250"))
+SLOW_CALLBACK_MS = float(os.getenv("SLOW_CALLBACK_MS", "0"))  # e.g. 100 logs callbacks that hold the loop longer; 0 (off) leaves asyncio untouched
+OWNER_ID = int(os.getenv("OWNER_ID", "0"))  # may run /profile; defaults to the userbot account
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "300"))
 
 MY_ID = None
 
@@ -33,10 +110,14 @@ if not all([API_ID, API_HASH, BOT_TOKEN, MONGO_URI]):
 
 # MongoDB Setup
 try:
-    mongo_client = MongoClient(MONGO_URI)
+    mongo_client = AsyncIOMotorClient(MONGO_URI)
     db = mongo_client.forwarder_bot
     tasks_collection = db.tasks
     stats_collection = db.stats
+    clone_jobs_collection = db.clone_jobs
+    queue_collection = db.delivery_queue
+    source_state_collection = db.source_state
+    sessions_collection = db.sessions
     LOGGER.info("Successfully connected to MongoDB.")
 except Exception as e:
     LOGGER.error(f"Error connecting to MongoDB: {e}")
@@ -50,173 +131,1538 @@ def parse_chat_ids(text: str) -> list[int] | None:
     except (ValueError, TypeError):
         return None
 
+LINK_PATTERN = re.compile(r'https?://(?:tera[a-z]+|tinyurl|teraboxurl|freeterabox)\.com/\S+')
+BLANK_LINES_PATTERN = re.compile(r'\n{3,}')
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600: return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+    if seconds >= 60: return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds}s"
+
 def create_beautiful_caption(original_text):
-    link_pattern = r'https?://(?:tera[a-z]+|tinyurl|teraboxurl|freeterabox)\.com/\S+'
-    links = re.findall(link_pattern, original_text or "")
+    links = LINK_PATTERN.findall(original_text or "")
     if not links: return None
     emojis = random.sample(['😍', '🔥', '❤️', '😈', '💯', '💦', '🔞'], 2)
     caption_parts = [f"Watch Full Videos {emojis[0]}{emojis[1]}"] + [f"V{i}:\n{link}" for i, link in enumerate(links, 1)]
     return "\n\n".join(caption_parts)
 
-async def generate_thumbnail(video_path):
-    thumb_path = None
+def extract_thumbnail(video_path: str, thumb_path: str | io.BytesIO) -> bool:
+    # Runs in THUMB_POOL. Seeks ~10% into the video to skip black intro frames.
+    # OpenCV and PIL are imported on first use so they don't slow down startup.
+    import cv2
+    from PIL import Image
+    cap = cv2.VideoCapture(video_path)
     try:
-        thumb_path = os.path.splitext(video_path)[0] + ".jpg"
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened(): return None
+        if not cap.isOpened(): return False
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        if frame_count > 1: cap.set(cv2.CAP_PROP_POS_FRAMES, frame_count // 10)
         ret, frame = cap.read()
-        if not ret: cap.release(); return None
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        img = Image.fromarray(frame_rgb)
+        if not ret and frame_count > 1: cap.set(cv2.CAP_PROP_POS_FRAMES, 0); ret, frame = cap.read()
+        if not ret: return False
+        img = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
         img.thumbnail((320, 320))
         img.save(thumb_path, "JPEG")
+        return True
+    finally:
         cap.release()
-        return thumb_path
+
+def extract_thumbnail_from_buffer(data: bytes) -> bytes | None:
+    # OpenCV only decodes files, so the video is spilled to the private transfer directory while it reads
+    with tempfile.NamedTemporaryFile(dir=TRANSFER.directory, suffix=".mp4") as video:
+        video.write(data); video.flush()
+        thumb = io.BytesIO()
+        return thumb.getvalue() if extract_thumbnail(video.name, thumb) else None
+
+async def generate_thumbnail(video_path, thumb_path: str | None = None):
+    """Returns a JPEG thumbnail for the video at `video_path`: a file at `thumb_path` (next to the video
+    by default), or bytes when `video_path` is an in-memory buffer from TRANSFER.download()."""
+    with METRICS.timed("thumbnail"): return await make_thumbnail(video_path, thumb_path)
+
+async def make_thumbnail(video_path, thumb_path: str | None = None):
+    if isinstance(video_path, io.BytesIO):
+        future = THUMB_POOL.submit(extract_thumbnail_from_buffer, video_path.getvalue())
+        try: return await asyncio.wait_for(asyncio.wrap_future(future), THUMB_TIMEOUT)
+        except asyncio.TimeoutError: LOGGER.warning(f"Thumbnail generation timed out after {THUMB_TIMEOUT}s: {video_path.name}")
+        except Exception as e: LOGGER.error(f"Thumbnail generation failed: {e}")
+        return None
+    thumb_path = thumb_path or os.path.splitext(video_path)[0] + ".jpg"
+    future = THUMB_POOL.submit(extract_thumbnail, video_path, thumb_path)
+    try:
+        if await asyncio.wait_for(asyncio.wrap_future(future), THUMB_TIMEOUT): return thumb_path
+    except asyncio.TimeoutError:
+        LOGGER.warning(f"Thumbnail generation timed out after {THUMB_TIMEOUT}s: {video_path}")
+        # The worker thread can't be interrupted; drop its output once it finishes
+        future.add_done_callback(lambda _: os.path.exists(thumb_path) and os.remove(thumb_path))
+        return None
     except Exception as e:
         LOGGER.error(f"Thumbnail generation failed: {e}")
-        if thumb_path and os.path.exists(thumb_path): os.remove(thumb_path)
-        return None
+    if os.path.exists(thumb_path): os.remove(thumb_path)
+    return None
+
+# --- Stats Aggregator ---
+# Per-message counters are buffered in memory and written with one bulk_write
+# every STATS_FLUSH_SECONDS or STATS_FLUSH_EVENTS events, and once more on shutdown.
+
+STATS_FIELDS = ("total_forwarded", "total_failed", "total_duplicates")
+
+class StatsAggregator:
+    def __init__(self, interval: float, max_events: int):
+        self.interval, self.max_events = interval, max_events
+        self.pending: dict[str, dict] = {}
+        self.events = 0
+        self.lock = asyncio.Lock()
+
+    def record(self, task_id: str, field: str):
+        entry = self.pending.setdefault(task_id, dict.fromkeys(STATS_FIELDS, 0))
+        entry[field] += 1
+        entry["last_activity"] = datetime.utcnow()
+        self.events += 1
+        if self.events >= self.max_events: spawn(self.flush())
+
+    async def flush(self):
+        async with self.lock:
+            if not self.pending: return
+            pending, self.pending, self.events = self.pending, {}, 0
+            ops = [UpdateOne({"task_id": task_id}, {"$inc": {f: e[f] for f in STATS_FIELDS}, "$set": {"last_activity": e["last_activity"]}}, upsert=True) for task_id, e in pending.items()]
+            try: await stats_collection.bulk_write(ops, ordered=False)
+            except Exception as e:
+                LOGGER.error(f"Failed to update stats: {e}")
+                # Fold the unsaved counts back in so the next flush retries them
+                for task_id, old in pending.items():
+                    entry = self.pending.setdefault(task_id, {**dict.fromkeys(STATS_FIELDS, 0), "last_activity": old["last_activity"]})
+                    for f in STATS_FIELDS: entry[f] += old[f]
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval); await self.flush()
+
+STATS = StatsAggregator(STATS_FLUSH_SECONDS, STATS_FLUSH_EVENTS)
 
 def update_stats(task_id: str, success: bool = True):
+    STATS.record(task_id, "total_forwarded" if success else "total_failed")
+
+# --- Metrics ---
+# In-memory latency histograms per pipeline stage, labelled by task and destination
+# where the stage has them (downloads and thumbnails are shared between tasks, so
+# they carry neither). Served in the Prometheus text format on
+# http://METRICS_HOST:METRICS_PORT/metrics and summarized as p50/p95/p99 in view_stats.
+#   route       TASK_INDEX lookup for every incoming message
+#   filter      CompiledTask.accepts(), per task
+#   download    download_media / parallel download of one file
+#   thumbnail   video thumbnail generation
+#   send        the send_file/send_message call itself, per destination
+#   deliver     from handing a message to the scheduler until it is sent, per task and destination
+#   album_wait  from an album's first part until it is flushed, per task
+#   flood_wait  FloodWait parks (the wait, not a measured time), per destination or account-wide
+#   loop_lag    how late the event loop woke a LoopMonitor sleep
+
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+STAGE_LABELS = ("stage", "task", "dest")
+
+def prometheus_labels(names, values) -> str:
+    return ",".join(f'{n}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34)).replace(chr(10), " ")}"' for n, v in zip(names, values))
+
+class Metrics:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.histograms: dict[tuple, list] = {}  # (stage, task, dest) -> per-bucket counts, overflow count, sum
+        self.errors: Counter = Counter()  # (stage, task, dest) -> failed observations
+
+    def observe(self, stage: str, seconds: float, task="", dest=""):
+        counts = self.histograms.get((stage, task, dest))
+        if counts is None: counts = self.histograms[(stage, task, dest)] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        counts[-1] += seconds
+
+    @contextmanager
+    def timed(self, stage: str, task="", dest="", start: float = 0.0):
+        """Times the block, or from `start` (a time.monotonic() value) if that is later."""
+        started = max(time.monotonic(), start)
+        try: yield
+        except BaseException:
+            self.errors[(stage, task, dest)] += 1; raise
+        finally: self.observe(stage, max(0.0, time.monotonic() - started), task, dest)
+
+    def quantiles(self, stage: str, task=None, qs=(0.5, 0.95, 0.99)) -> tuple[int, list[float]] | None:
+        """Merges the stage's histograms (only `task`'s if given) and interpolates quantiles within buckets."""
+        merged = [0] * (len(self.buckets) + 1)
+        for (name, task_id, _), counts in self.histograms.items():
+            if name == stage and (task is None or task_id == task):
+                for i, c in enumerate(counts[:-1]): merged[i] += c
+        total = sum(merged)
+        if not total: return None
+        values = []
+        for q in qs:
+            rank, seen = q * total, 0
+            for i, c in enumerate(merged):
+                if c and seen + c >= rank:
+                    if i == len(self.buckets): values.append(self.buckets[-1]); break
+                    low = self.buckets[i - 1] if i else 0.0
+                    values.append(low + (self.buckets[i] - low) * (rank - seen) / c); break
+                seen += c
+        return total, values
+
+    def render(self, gauges: dict[str, float]) -> str:
+        lines = ["# TYPE forwarder_stage_seconds histogram"]
+        for key, counts in sorted(self.histograms.items(), key=lambda item: tuple(map(str, item[0]))):
+            labels, cumulative = prometheus_labels(STAGE_LABELS, key), 0
+            for bound, c in zip((*self.buckets, "+Inf"), counts[:-1]):
+                cumulative += c
+                lines.append(f'forwarder_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines += [f"forwarder_stage_seconds_sum{{{labels}}} {counts[-1]}", f"forwarder_stage_seconds_count{{{labels}}} {cumulative}"]
+        lines.append("# TYPE forwarder_stage_errors_total counter")
+        lines += [f"forwarder_stage_errors_total{{{prometheus_labels(STAGE_LABELS, key)}}} {n}" for key, n in self.errors.items()]
+        for name, value in gauges.items(): lines.append(f"forwarder_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+METRICS = Metrics(LATENCY_BUCKETS)
+
+def metrics_gauges() -> dict[str, float]:
+    gauges = {f"backoff_{name}": value for name, value in BACKOFF.counters.items()}
+    gauges.update(dedup_hits=DEDUP.hits, dedup_misses=DEDUP.misses, dedup_entries=len(DEDUP.entries),
+                  media_cache_hits=MEDIA_CACHE.hits, media_cache_misses=MEDIA_CACHE.misses, media_cache_bytes=MEDIA_CACHE.size,
+                  memory_cache_hits=TRANSFER.hits, memory_cache_misses=TRANSFER.misses, memory_cache_bytes=TRANSFER.recent_bytes,
+                  queue_pending=len(QUEUE.jobs) + len(QUEUE.incoming), albums_pending=len(ALBUMS.buffers),
+                  pool_sessions=len(POOL.extra) + 1, pool_sessions_parked=sum(BACKOFF.parked_for(session=s) > 0 for s in [client, *POOL.extra.values()]))
+    return gauges
+
+async def serve_metrics_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request = (await asyncio.wait_for(reader.readline(), 10)).split()
+        if len(request) >= 2 and request[0] == b"GET" and request[1].split(b"?")[0] == b"/metrics":
+            status, body = "200 OK", METRICS.render(metrics_gauges()).encode()
+        else: status, body = "404 Not Found", b"Not found\n"
+        writer.write(f"HTTP/1.0 {status}\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except Exception as e: LOGGER.debug(f"Metrics request failed: {e}")
+    finally: writer.close()
+
+def format_quantiles(stage: str, task=None) -> str | None:
+    summary = METRICS.quantiles(stage, task)
+    if not summary: return None
+    total, values = summary
+    return f"{stage}: " + " / ".join(f"{v * 1000:.0f}ms" if v < 10 else f"{v:.0f}s" for v in values) + f" ({total})"
+
+# --- Task Pipelines ---
+# Filters and caption rules are compiled once per task when the routing index is
+# (re)loaded, so the hot path is a single regex scan per word list per message.
+
+def compile_word_pattern(words) -> re.Pattern | None:
+    """Compiles literal words into one trie-shaped regex; search() cost stays flat as the list grows."""
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word: node = node.setdefault(ch, {})
+        node[""] = {}
+    if not trie: return None
+
+    # Built bottom-up with an explicit stack: the trie is as deep as the longest word
+    regex, stack = {}, [(trie, False)]
+    while stack:
+        node, children_done = stack.pop()
+        if "" in node: regex[id(node)] = ""; continue  # a shorter word already matches here
+        if not children_done:
+            stack.append((node, True)); stack.extend((child, False) for child in node.values()); continue
+        branches = [re.escape(ch) + regex[id(child)] for ch, child in sorted(node.items())]
+        regex[id(node)] = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    return re.compile(regex[id(trie)])
+
+class CompiledTask:
+    def __init__(self, doc: dict):
+        filters_doc, mods, settings = doc.get("filters", {}), doc.get("modifications", {}), doc.get("settings", {})
+        self.doc, self.id, self.owner_id = doc, doc["_id"], doc.get("owner_id")
+        self.dest_ids = doc.get("destination_ids", [])
+        self.delay, self.block_me = settings.get("delay", 0), settings.get("block_me", False)
+        self.copy_mode = settings.get("copy_mode", COPY_MODE_DEFAULT)
+        self.block_videos, self.block_photos = filters_doc.get("block_videos"), filters_doc.get("block_photos")
+        self.block_documents, self.block_text = filters_doc.get("block_documents"), filters_doc.get("block_text")
+        # Word lists match case-insensitively against the lowercased message text
+        self.blacklist = compile_word_pattern(w.lower() for w in (filters_doc.get("blacklist_words") or "").splitlines() if w.strip())
+        self.whitelist = compile_word_pattern(w.lower() for w in (filters_doc.get("whitelist_words") or "").splitlines() if w.strip())
+        self.remove_lines = frozenset(l.strip() for l in mods["remove_texts"].splitlines() if l.strip()) if mods.get("remove_texts") else None
+        self.replace_rules = tuple(tuple(part.strip() for part in rule.split('=>', 1)) for rule in (mods.get("replace_rules") or "").splitlines() if '=>' in rule)
+        self.beautiful_captions, self.footer_text = mods.get("beautiful_captions"), mods.get("footer_text")
+
+    def accepts(self, message: Message, is_video: bool, text_lower: str) -> bool:
+        if self.block_me and message.sender_id == self.owner_id and not message.reply_to: return False
+        if self.block_videos and is_video: return False
+        if self.block_photos and message.photo: return False
+        if self.block_documents and message.document and not is_video: return False
+        if self.block_text and not message.media: return False
+        if self.blacklist and self.blacklist.search(text_lower): return False
+        if self.whitelist and not self.whitelist.search(text_lower): return False
+        return True
+
+    def caption(self, text: str | None) -> str:
+        text = text or ""
+        if self.remove_lines is not None:
+            text = "\n".join(line for line in text.splitlines() if line.strip() not in self.remove_lines)
+        for find, repl in self.replace_rules: text = text.replace(find, repl)
+        if self.beautiful_captions:
+            new_caption = create_beautiful_caption(text)
+            if new_caption: text = new_caption
+        if text: text = BLANK_LINES_PATTERN.sub('\n\n', text).strip()
+        if self.footer_text: text = f"{text or ''}\n\n{self.footer_text}"
+        return text
+
+# --- Task Routing Index ---
+# Maps every form of a source chat ID (as stored, bare, and "-100"-marked) to the
+# active tasks watching it, so the NewMessage handler looks up event.chat_id as-is
+# and drops unwatched chats without touching MongoDB. SOURCE_KEYS maps the same
+# forms to the bare ID used as the source's key everywhere else. A task edit
+# recompiles only that task (from the change stream's document key, or from the
+# bot's own write when change streams are unavailable); the index itself is then
+# rebuilt from the already compiled tasks.
+
+TASK_INDEX: dict[int, list[CompiledTask]] = {}
+SOURCE_KEYS: dict[int, int] = {}
+ACTIVE_TASKS: dict[str, CompiledTask] = {}  # task ID -> compiled active task
+TASK_STREAM_ACTIVE = False
+
+def normalize_chat_id(chat_id) -> int:
+    key = SOURCE_KEYS.get(chat_id)
+    if key is not None: return key
+    s = str(chat_id)
+    return int(s[4:]) if s.startswith("-100") else int(s)
+
+def chat_id_forms(chat_id) -> set[int]:
+    key = normalize_chat_id(chat_id)
+    return {int(chat_id), key, int(f"-100{key}")} if key > 0 else {int(chat_id), key}
+
+def rebuild_task_index():
+    global TASK_INDEX, SOURCE_KEYS
+    by_key, keys = {}, {}
+    for task in ACTIVE_TASKS.values():
+        for source_id in task.doc.get("source_ids", []):
+            key = normalize_chat_id(source_id)
+            by_key.setdefault(key, []).append(task)
+            keys.update(dict.fromkeys(chat_id_forms(source_id), key))
+    TASK_INDEX, SOURCE_KEYS = {form: by_key[key] for form, key in keys.items()}, keys
+    if POOL.extra: spawn(POOL.assign_sources())
+
+def compile_task(doc: dict) -> CompiledTask | None:
+    # One task with settings that don't compile is skipped; the others keep forwarding
+    try: return CompiledTask(doc)
+    except Exception as e:
+        LOGGER.error(f"Task {doc.get('_id')} skipped, its settings don't compile: {e}"); return None
+
+async def load_task_index():
+    """Recompiles every active task; used at startup and whenever change events may have been missed."""
+    global ACTIVE_TASKS
+    tasks = {}
+    try:
+        async for doc in tasks_collection.find({"status": "active"}):
+            if task := compile_task(doc): tasks[doc["_id"]] = task
+    except Exception as e:
+        LOGGER.error(f"Failed to load task index: {e}"); return
+    ACTIVE_TASKS = tasks
+    rebuild_task_index()
+    LOGGER.info(f"Task index loaded: {len(ACTIVE_TASKS)} tasks, {len(set(SOURCE_KEYS.values()))} source chats.")
+
+async def refresh_task(task_id: str):
+    """Recompiles one task (or drops it if it was deleted or stopped) and rebuilds the index."""
+    try: doc = await tasks_collection.find_one({"_id": task_id})
+    except Exception as e:
+        LOGGER.error(f"Failed to reload task {task_id}: {e}"); return
+    task = compile_task(doc) if doc and doc.get("status") == "active" else None
+    if task: ACTIVE_TASKS[task_id] = task
+    else: ACTIVE_TASKS.pop(task_id, None)
+    rebuild_task_index()
+
+async def task_changed(task_id: str):
+    # Called after the bot's own writes; the change stream delivers those too when it is running
+    if not TASK_STREAM_ACTIVE: await refresh_task(task_id)
+
+async def watch_task_changes():
+    # Standalone MongoDB has no change streams, in which case the bot's own
+    # writes are the only invalidation source.
+    global TASK_STREAM_ACTIVE
+    while True:
+        try:
+            async with tasks_collection.watch() as stream:
+                TASK_STREAM_ACTIVE = True
+                async for change in stream: await refresh_task(change["documentKey"]["_id"])
+        except OperationFailure as e:
+            TASK_STREAM_ACTIVE = False
+            LOGGER.warning(f"Task change stream unavailable, using local invalidation only: {e}"); return
+        except Exception as e:
+            TASK_STREAM_ACTIVE = False
+            LOGGER.warning(f"Task change stream interrupted: {e}")
+            await asyncio.sleep(5); await load_task_index()
+
+# --- Loop Monitor ---
+# Telethon, the control bot, Mongo calls and the pipeline share one event loop, so
+# anything that blocks it stalls everything. A sampler records how late a sleep
+# wakes up (the "loop_lag" metric). When SLOW_CALLBACK_MS is set, a hook around
+# asyncio's Handle._run logs each callback that holds the loop that long or more,
+# naming the task and the coroutine it was suspended in afterwards; it times every
+# callback, so it is off by default. /profile runs cProfile on the loop thread on
+# demand. Disabled parts install nothing.
+
+ASYNCIO_DIR = os.path.dirname(asyncio.__file__)
+
+def callback_name(callback) -> str:
+    task = getattr(callback, "__self__", None)
+    if not isinstance(task, asyncio.Task): return getattr(callback, "__qualname__", repr(callback))
+    chain, coro = [], task.get_coro()
+    while coro is not None and getattr(coro, "cr_frame", None) is not None:
+        if not coro.cr_code.co_filename.startswith(ASYNCIO_DIR): chain.append(f"{coro.cr_code.co_name}:{coro.cr_frame.f_lineno}")
+        coro = coro.cr_await
+    return f"{task.get_name()} ({' → '.join(chain) or getattr(task.get_coro(), '__qualname__', '?')})"
+
+class LoopMonitor:
+    def __init__(self, interval: float, warn_ms: float, slow_callback_ms: float):
+        self.interval, self.warn, self.slow_callback = interval, warn_ms / 1000, slow_callback_ms / 1000
+        self.slow_callbacks: Counter = Counter()  # callback name -> times it blocked the loop
+
+    def start(self):
+        if self.slow_callback > 0: self._hook_callbacks()
+        if self.interval > 0: spawn(self._sample())
+
+    async def _sample(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = time.monotonic() - started - self.interval
+            METRICS.observe("loop_lag", lag)
+            if lag >= self.warn: LOGGER.warning(f"🐢 Event loop lagged {lag * 1000:.0f}ms")
+
+    def _hook_callbacks(self):
+        run, threshold, seen = asyncio.events.Handle._run, self.slow_callback, self.slow_callbacks
+
+        def timed_run(handle):
+            started = time.perf_counter()
+            run(handle)
+            elapsed = time.perf_counter() - started
+            if elapsed >= threshold:
+                name = callback_name(handle._callback); seen[name] += 1
+                LOGGER.warning(f"🐢 Slow callback: {name} held the loop for {elapsed * 1000:.0f}ms")
+        asyncio.events.Handle._run = timed_run
+
+LOOP_MONITOR = LoopMonitor(LOOP_LAG_INTERVAL, LOOP_LAG_WARN_MS, SLOW_CALLBACK_MS)
+PROFILE_LOCK = asyncio.Lock()
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/profile <seconds>: profiles the event loop thread and replies with a report and the raw pstats file."""
+    if update.effective_user.id == (OWNER_ID or MY_ID):
+        try: seconds = min(PROFILE_MAX_SECONDS, max(1.0, float(context.args[0]))) if context.args else 30.0
+        except ValueError: await update.message.reply_text("Usage: /profile <seconds>")
+        else: spawn(run_profile(update, seconds))  # updates are handled one at a time; don't hold them up
+    raise ApplicationHandlerStop  # not a reply to whatever conversation step is open
+
+async def run_profile(update: Update, seconds: float):
+    if PROFILE_LOCK.locked(): await update.message.reply_text("⏱ A profile is already running."); return
+    async with PROFILE_LOCK:
+        await update.message.reply_text(f"⏱ Profiling the event loop for {seconds:g}s...")
+        profiler = cProfile.Profile(); profiler.enable()
+        try: await asyncio.sleep(seconds)
+        finally: profiler.disable()
+    report = io.StringIO()
+    lag = METRICS.quantiles("loop_lag")
+    if lag: report.write(f"Loop lag p50/p95/p99: {' / '.join(f'{v * 1000:.0f}ms' for v in lag[1])} over {lag[0]} samples\n")
+    if not LOOP_MONITOR.slow_callback: report.write("Slow callbacks: not tracked (SLOW_CALLBACK_MS is 0)\n")
+    for name, count in LOOP_MONITOR.slow_callbacks.most_common(10): report.write(f"Slow callback x{count}: {name}\n")
+    stats = pstats.Stats(profiler, stream=report)
+    for key in ("tottime", "cumulative"): stats.sort_stats(key).print_stats(40)
+    stamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+    await update.message.reply_document(io.BytesIO(report.getvalue().encode()), filename=f"profile-{stamp}.txt", caption=f"⏱ {seconds:g}s profile, sorted by own and cumulative time")
+    await update.message.reply_document(io.BytesIO(marshal.dumps(stats.stats)), filename=f"profile-{stamp}.prof", caption="Raw pstats data (python -m pstats, snakeviz)")
+
+# --- Backoff Controller ---
+# Turns FloodWaits and transient network errors into bounded, observable delay.
+# A FloodWait parks either the destination chat (slow mode, short per-chat waits)
+# or the whole account (one pool session); the scheduler and BACKOFF.call() honour
+# both before issuing the next request, and the pool routes sends around parked accounts.
+
+TRANSIENT_ERRORS = (ConnectionError, TimeoutError, TimedOutError)
+
+class BackoffController:
+    def __init__(self, max_attempts: int, max_backoff: float, chat_max_seconds: int):
+        self.max_attempts, self.max_backoff, self.chat_max_seconds = max_attempts, max_backoff, chat_max_seconds
+        self.account_until: dict = {}  # session -> parked until
+        self.chat_until: dict[int, float] = {}
+        self.counters = {"flood_waits": 0, "flood_seconds": 0.0, "retries": 0, "retry_seconds": 0.0, "given_up": 0}
+
+    def parked_for(self, chat_id=None, session=None) -> float:
+        return max(self.account_until.get(session or client, 0.0), self.chat_until.get(chat_id, 0.0)) - time.monotonic()
+
+    def retry_after(self, error: Exception, chat_id, attempt: int, session=None) -> float | None:
+        """Returns the seconds to wait before retrying after `error` (raised by `session`, the
+        primary one by default), or None if it must not be retried."""
+        if not isinstance(error, (FloodError, *TRANSIENT_ERRORS)): return None
+        if attempt >= self.max_attempts:
+            self.counters["given_up"] += 1; return None
+        if isinstance(error, FloodError):
+            seconds = getattr(error, "seconds", 0) or 1
+            wait = seconds + random.uniform(0, min(5.0, 1 + seconds * 0.1))
+            per_chat = chat_id is not None and (isinstance(error, SlowModeWaitError) or (isinstance(error, FloodWaitError) and seconds <= self.chat_max_seconds))
+            if per_chat: self.chat_until[chat_id] = time.monotonic() + wait
+            else: session = session or client; self.account_until[session] = max(self.account_until.get(session, 0.0), time.monotonic() + wait)
+            self.counters["flood_waits"] += 1; self.counters["flood_seconds"] += wait
+            METRICS.observe("flood_wait", wait, dest=chat_id if per_chat else "")
+            LOGGER.warning(f"⏳ {type(error).__name__}: parking {'chat ' + str(chat_id) if per_chat else 'account ' + POOL.name(session)} for {wait:.1f}s")
+            return wait
+        wait = min(self.max_backoff, 2 ** attempt) * random.uniform(0.5, 1.0)
+        self.counters["retries"] += 1; self.counters["retry_seconds"] += wait
+        LOGGER.warning(f"🔁 {type(error).__name__}: {error}; retrying in {wait:.1f}s")
+        return wait
+
+    async def call(self, job, chat_id=None, session=None):
+        """Runs `job` (a coroutine function issuing requests as `session`), waiting out parks and retrying retryable errors."""
+        attempt = 0
+        while True:
+            park = self.parked_for(chat_id, session)
+            if park > 0: await asyncio.sleep(park)
+            try: return await job()
+            except Exception as e:
+                wait = self.retry_after(e, chat_id, attempt, session)
+                if wait is None: raise
+                attempt += 1
+                if not isinstance(e, FloodError): await asyncio.sleep(wait)
+
+BACKOFF = BackoffController(RETRY_MAX_ATTEMPTS, RETRY_MAX_BACKOFF, FLOOD_CHAT_MAX_SECONDS)
+
+# --- Send Scheduler ---
+# Every send goes through a queue per destination chat. A fixed pool of workers
+# drains the queues round-robin, one send per chat at a time (so per-chat order
+# is kept), pacing each chat with a token bucket whose rate halves on every
+# FloodWait and climbs back on success. Jobs that are not due yet, whose
+# chat is out of tokens, or that hit a FloodWait are parked with call_later instead
+# of holding a worker. The pool picks the sending session when a job is dispatched,
+# so a destination moves to another account while its own is in FloodWait.
+
+BACKGROUND_TASKS: set[asyncio.Task] = set()
+
+def spawn(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    BACKGROUND_TASKS.add(task); task.add_done_callback(BACKGROUND_TASKS.discard)
+    return task
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int):
+        self.rate, self.capacity = rate, capacity
+        self.tokens, self.updated = float(capacity), time.monotonic()
+
+    def try_acquire(self) -> float:
+        """Takes a token if one is available; otherwise returns the seconds until one is."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1: self.tokens -= 1; return 0.0
+        return (1 - self.tokens) / self.rate
+
+class SendScheduler:
+    def __init__(self, workers: int, rate: float, burst: int):
+        self.workers, self.rate, self.burst = workers, rate, burst
+        self.pending: dict[int, deque] = {}
+        self.buckets: dict[int, TokenBucket] = {}
+        self.scheduled: set[int] = set()
+        self.task_slots: dict[str, float] = {}
+        self.ready: asyncio.Queue = asyncio.Queue()
+
+    def start(self):
+        for _ in range(self.workers): spawn(self._worker())
+
+    def reserve(self, task_id: str, delay: float) -> float:
+        """Returns the earliest time the task's next message may go out and books the slot after it."""
+        now = time.monotonic()
+        at = max(now, self.task_slots.get(task_id, now))
+        self.task_slots[task_id] = at + delay
+        return at
+
+    def submit(self, dest_id: int, job, not_before: float = 0.0, session=None) -> asyncio.Future:
+        """Queues `job` (a coroutine function taking the session to send as) for `dest_id`; the future
+        resolves with its result. The pool chooses the session unless one is given."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        wait = not_before - time.monotonic()
+        if wait > 0: loop.call_later(wait, self._enqueue, dest_id, job, future, session)
+        else: self._enqueue(dest_id, job, future, session)
+        return future
+
+    def _enqueue(self, dest_id, job, future, session):
+        self.pending.setdefault(dest_id, deque()).append((job, future, 0, session))
+        if dest_id not in self.scheduled:
+            self.scheduled.add(dest_id); self.ready.put_nowait(dest_id)
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            dest_id = await self.ready.get()
+            queue = self.pending[dest_id]
+            session = queue[0][3] or POOL.sender(dest_id)
+            wait = BACKOFF.parked_for(dest_id, session)
+            if wait <= 0: wait = self.buckets.setdefault(dest_id, TokenBucket(self.rate, self.burst)).try_acquire()
+            if wait > 0:
+                loop.call_later(wait, self.ready.put_nowait, dest_id); continue
+            job, future, attempt, pinned = queue.popleft()
+            bucket = self.buckets[dest_id]
+            if not future.done():
+                try:
+                    with METRICS.timed("send", dest=dest_id): future.set_result(await job(session))
+                    bucket.rate = min(self.rate, bucket.rate + self.rate / 20)  # recover gradually after a flood
+                except Exception as e:
+                    if isinstance(e, FloodError): bucket.rate = max(self.rate / 16, bucket.rate / 2)
+                    retry = BACKOFF.retry_after(e, dest_id, attempt, session)
+                    if retry is not None:
+                        queue.appendleft((job, future, attempt + 1, pinned))
+                        # An account-wide park moves the destination to another session; retry there right away
+                        if not pinned and POOL.sender(dest_id) is not session: retry = 0
+                        loop.call_later(retry, self.ready.put_nowait, dest_id); continue
+                    if not future.done(): future.set_exception(e)
+            if queue: self.ready.put_nowait(dest_id)
+            else: self.scheduled.discard(dest_id); del self.pending[dest_id]
+
+SCHEDULER = SendScheduler(SEND_WORKERS, SEND_RATE_PER_CHAT, SEND_BURST_PER_CHAT)
+
+# --- Large File Transfer ---
+# Telethon's download_media and upload_file keep one part request in flight, so a
+# large file moves at one part per round trip. Files of LARGE_FILE_MB and up are
+# split into TRANSFER_PART_KB parts with TRANSFER_PARALLELISM requests in flight
+# instead; each worker resumes from its last finished part when BACKOFF retries it.
+
+def is_large_file(size) -> bool:
+    return bool(size) and size >= LARGE_FILE_MB * 2**20
+
+async def download_parallel(message: Message, path: str) -> str:
+    session = getattr(message, "client", None) or client  # file references are only valid for the account that saw the message
+    document, part = message.document, TRANSFER_PART_KB * 1024
+    stride = part * TRANSFER_PARALLELISM
+    next_offsets = list(range(0, min(stride, document.size), part))  # worker k owns parts k, k+N, k+2N, ...
+
+    async def worker(k, f):
+        remaining = len(range(next_offsets[k], document.size, stride))
+        if not remaining: return
+        async for chunk in session.iter_download(document, offset=next_offsets[k], stride=stride, limit=remaining, request_size=part, file_size=document.size):
+            f.seek(next_offsets[k]); f.write(chunk)
+            next_offsets[k] += stride
+
     try:
-        stats_collection.update_one(
-            {"task_id": task_id}, 
-            {
-                "$inc": {"total_forwarded" if success else "total_failed": 1}, 
-                "$set": {"last_activity": datetime.utcnow()}
-            }, 
-            upsert=True
-        )
-    except Exception as e: LOGGER.error(f"Failed to update stats: {e}")
-
-def apply_text_modifications(text, mods):
-    if not text: text = ""
-    if mods.get("remove_texts"):
-        remove_list = [l.strip() for l in mods["remove_texts"].splitlines() if l.strip()]
-        text = "\n".join([line for line in text.splitlines() if line.strip() not in remove_list])
-    if mods.get("replace_rules"):
-        for rule in mods["replace_rules"].splitlines():
-            if '=>' in rule: 
-                find, repl = rule.split('=>', 1)
-                text = text.replace(find.strip(), repl.strip())
-    if mods.get("beautiful_captions"):
-        new_caption = create_beautiful_caption(text)
-        if new_caption: text = new_caption
-    if text: text = re.sub(r'\n{3,}', '\n\n', text).strip()
-    if mods.get("footer_text"): text = f"{text or ''}\n\n{mods['footer_text']}"
-    return text
+        with open(path, "wb") as f:
+            f.truncate(document.size)
+            await asyncio.gather(*(BACKOFF.call(lambda k=k: worker(k, f), session=session) for k in range(len(next_offsets))))
+    except BaseException:
+        if os.path.exists(path): os.remove(path)
+        raise
+    return path
+
+async def upload_parallel(path: str, session=None) -> InputFileBig:
+    session = session or client
+    size, part = os.path.getsize(path), TRANSFER_PART_KB * 1024
+    total, file_id = (size + part - 1) // part, random.getrandbits(63)
+    pending = iter(range(total))  # shared by the workers, each takes the next unsent part
+
+    async def worker(f):
+        for index in pending:
+            f.seek(index * part); data = f.read(part)
+            request = functions.upload.SaveBigFilePartRequest(file_id, index, total, data)
+            if not await BACKOFF.call(lambda: session(request), session=session): raise RuntimeError(f"Failed to upload file part {index}.")
+
+    with open(path, "rb") as f:
+        await asyncio.gather(*(worker(f) for _ in range(min(TRANSFER_PARALLELISM, total))))
+    return InputFileBig(file_id, total, os.path.basename(path))
+
+async def download_to_disk(message: Message, stem: str) -> str | None:
+    """Downloads `message`'s media to `stem` plus the media's extension."""
+    if message.document and is_large_file(message.document.size):
+        with METRICS.timed("download"): return await download_parallel(message, stem + (message.file.ext or ""))
+    with METRICS.timed("download"): return await BACKOFF.call(lambda: message.download_media(file=stem), session=getattr(message, "client", None))
+
+async def upload_media(file, session=None):
+    """Uploads `file` as `session` (the primary one by default); the handle is only valid for that account."""
+    if isinstance(file, str) and is_large_file(os.path.getsize(file)): return await upload_parallel(file, session)
+    return await BACKOFF.call(lambda: (session or client).upload_file(file), session=session)
+
+# --- Media Transfer ---
+# Files up to TRANSFER_MEMORY_MAX_MB go into a BytesIO and never touch disk, as long
+# as all buffers together stay within TRANSFER_MEMORY_BUDGET_MB; recently downloaded
+# ones are kept in an in-memory LRU of TRANSFER_MEMORY_CACHE_MB, keyed like the media
+# cache. Larger files (and small ones over the budget) get a unique name in a
+# per-process directory under TRANSFER_DIR; directories left behind by a process that
+# died are removed on startup.
+
+class TransferSpool:
+    def __init__(self, base_dir: str, memory_max_bytes: int, memory_budget_bytes: int, recent_max_bytes: int):
+        self.memory_max_bytes, self.memory_budget_bytes, self.recent_max_bytes = memory_max_bytes, memory_budget_bytes, recent_max_bytes
+        self.memory_used = 0
+        self.recent: OrderedDict[str, bytes] = OrderedDict()  # cache key -> file contents, least recently used first
+        self.recent_bytes, self.hits, self.misses = 0, 0, 0
+        os.makedirs(base_dir, exist_ok=True)
+        for item in os.scandir(base_dir):
+            if item.is_dir() and not self.pid_alive(item.name): shutil.rmtree(item.path, ignore_errors=True)
+        self.directory = os.path.join(base_dir, str(os.getpid()))
+        os.makedirs(self.directory, exist_ok=True)
+        atexit.register(shutil.rmtree, self.directory, True)
+
+    @staticmethod
+    def pid_alive(name: str) -> bool:
+        try: os.kill(int(name), 0)
+        except (ValueError, ProcessLookupError): return False
+        except PermissionError: pass
+        return True
+
+    def is_small(self, message: Message) -> bool:
+        size = message.file.size if message.file else None
+        return size is not None and size <= self.memory_max_bytes
+
+    def fits_in_memory(self, message: Message) -> bool:
+        return self.is_small(message) and self.memory_used + message.file.size <= self.memory_budget_bytes
+
+    def new_path(self) -> str:
+        # Telethon appends the media's extension
+        return os.path.join(self.directory, uuid.uuid4().hex)
+
+    async def download(self, message: Message) -> io.BytesIO | str | None:
+        """Downloads `message`'s media into a named BytesIO or a private temp file; see release()."""
+        key = MediaCache.key_for(message) if self.is_small(message) else None
+        data = self.recent.get(key) if key else None
+        if data is not None:
+            self.hits += 1; self.recent.move_to_end(key)
+        else:
+            if not self.fits_in_memory(message): return await download_to_disk(message, self.new_path())
+            self.memory_used += message.file.size  # reserved up front, so concurrent downloads can't overshoot the budget
+            try:
+                with METRICS.timed("download"): data = await BACKOFF.call(lambda: message.download_media(file=bytes), session=getattr(message, "client", None))
+            finally:
+                self.memory_used -= message.file.size
+            if not data: return None
+            self.misses += 1; self.remember(key, data)
+        buffer = io.BytesIO(data); self.memory_used += len(data)
+        buffer.name = f"{message.id}{message.file.ext or ''}"  # lets Telethon pick the MIME type and attributes
+        return buffer
+
+    def remember(self, key: str | None, data: bytes):
+        if key is None or self.recent_max_bytes <= 0 or len(data) > self.recent_max_bytes or key in self.recent: return
+        self.recent[key] = data; self.recent_bytes += len(data)
+        while self.recent_bytes > self.recent_max_bytes: self.recent_bytes -= len(self.recent.popitem(last=False)[1])
+
+    def release(self, *items):
+        for item in items:
+            if isinstance(item, io.BytesIO):
+                if not item.closed: self.memory_used -= len(item.getbuffer()); item.close()
+            elif isinstance(item, str) and os.path.exists(item): os.remove(item)
+
+TRANSFER = TransferSpool(TRANSFER_DIR, int(TRANSFER_MEMORY_MAX_MB * 2**20), int(TRANSFER_MEMORY_BUDGET_MB * 2**20), int(TRANSFER_MEMORY_CACHE_MB * 2**20))
+
+# --- Media Cache ---
+# Downloads and thumbnails are kept on disk keyed by Telegram's photo/document ID
+# and access hash, so a file reposted across chats and tasks is fetched once.
+# Entries in use are pinned and never evicted; the rest are evicted LRU-first
+# once the cache grows past MEDIA_CACHE_MAX_MB.
+
+class MediaCache:
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory, self.max_bytes = directory, max_bytes
+        self.entries: OrderedDict[str, dict] = OrderedDict()  # least recently used first
+        self.size, self.hits, self.misses = 0, 0, 0
+        self.pins: Counter = Counter()
+        self.inflight: dict[str, asyncio.Task] = {}
+        if max_bytes > 0: self._scan()
+
+    @staticmethod
+    def key_for(message: Message) -> str | None:
+        media = message.document or message.photo
+        return f"{type(media).__name__.lower()}_{media.id}_{media.access_hash}" if media else None
+
+    def _scan(self):
+        os.makedirs(self.directory, exist_ok=True)
+        for item in sorted((e for e in os.scandir(self.directory) if e.is_file()), key=lambda e: e.stat().st_mtime):
+            if item.name.startswith("tmp_"): os.remove(item.path); continue  # interrupted download or thumbnail
+            if item.name.endswith(".thumb.jpg"): key, field = item.name[:-len(".thumb.jpg")], "thumb"
+            else: key, field = os.path.splitext(item.name)[0], "path"
+            entry = self.entries.setdefault(key, {"path": None, "thumb": None, "size": 0})
+            entry[field] = item.path; entry["size"] += item.stat().st_size; self.size += item.stat().st_size
+            self.entries.move_to_end(key)
+        for key in [k for k, e in self.entries.items() if not e["path"]]: self._drop(key)
+        self._evict()
+        LOGGER.info(f"Media cache: {len(self.entries)} files, {self.size / 2**20:.0f} MB.")
+
+    async def fetch(self, message: Message, with_thumb: bool = False) -> dict | None:
+        """Returns the cache entry for `message`, downloading it on a miss, or None if it can't be cached.
+        The entry stays pinned until release() is called with the message's key."""
+        key = self.key_for(message)
+        if self.max_bytes <= 0 or key is None: return None
+        self.pins[key] += 1
+        try:
+            entry = self.entries.get(key)
+            if entry and os.path.exists(entry["path"]):
+                self.hits += 1; self.entries.move_to_end(key)
+            else:
+                if key in self.inflight: self.hits += 1  # another caller is already downloading it
+                else: self.misses += 1; self.inflight[key] = spawn(self._download(key, message))
+                entry = await asyncio.shield(self.inflight[key])
+            if with_thumb and not entry["thumb"]:
+                # Rendered once per key too: concurrent renders would race on the same <key>.jpg
+                if key + ".thumb" not in self.inflight: self.inflight[key + ".thumb"] = spawn(self._thumbnail(key, entry))
+                await asyncio.shield(self.inflight[key + ".thumb"])
+            return entry
+        except BaseException:
+            self.release(key); raise
+
+    async def _download(self, key: str, message: Message) -> dict:
+        try:
+            tmp = await download_to_disk(message, os.path.join(self.directory, f"tmp_{key}"))
+            if not tmp: raise ValueError("message has no downloadable media")
+            path = os.path.join(self.directory, key + os.path.splitext(tmp)[1]); os.replace(tmp, path)
+            self._drop(key)
+            entry = self.entries[key] = {"path": path, "thumb": None, "size": os.path.getsize(path)}
+            self.size += entry["size"]; self._evict()
+            return entry
+        finally:
+            self.inflight.pop(key, None)
+
+    async def _thumbnail(self, key: str, entry: dict):
+        try:
+            # Rendered under a tmp_ name, which _scan() discards if the process dies before the rename
+            thumb = await generate_thumbnail(entry["path"], os.path.join(self.directory, f"tmp_{key}.jpg"))
+            if thumb and not entry["thumb"]:
+                entry["thumb"] = os.path.join(self.directory, f"{key}.thumb.jpg"); os.replace(thumb, entry["thumb"])
+                entry["size"] += os.path.getsize(entry["thumb"]); self.size += os.path.getsize(entry["thumb"])
+        finally:
+            self.inflight.pop(key + ".thumb", None)
+
+    def release(self, key: str):
+        self.pins[key] -= 1
+        if self.pins[key] <= 0: del self.pins[key]
+        self._evict()
+
+    def _drop(self, key: str):
+        entry = self.entries.pop(key, None)
+        if not entry: return
+        for path in (entry["path"], entry["thumb"]):
+            if path and os.path.exists(path): os.remove(path)
+        self.size -= entry["size"]
+
+    def _evict(self):
+        for key in list(self.entries):
+            if self.size <= self.max_bytes: break
+            if not self.pins[key]: self._drop(key)
+
+MEDIA_CACHE = MediaCache(MEDIA_CACHE_DIR, MEDIA_CACHE_MAX_MB * 2**20)
+
+async def fetch_media(message: Message, with_thumb: bool | None = None) -> tuple:
+    """Returns (file, thumb, cache_key) for `message`; hand the tuple to release_media() when done.
+    Small media comes back as an in-memory buffer from TRANSFER and never touches disk (unless the memory
+    budget is used up); larger media as a path in the disk cache, or spooled by TRANSFER when it can't be cached."""
+    if not message.media: return None, None, None
+    if with_thumb is None: with_thumb = is_video_message(message)
+    if not TRANSFER.is_small(message):
+        entry = await MEDIA_CACHE.fetch(message, with_thumb)
+        if entry: return entry["path"], entry["thumb"], MEDIA_CACHE.key_for(message)
+    file = await TRANSFER.download(message)
+    thumb = await generate_thumbnail(file) if file and with_thumb else None
+    return file, thumb, None
+
+def release_media(path, thumb_path, cache_key: str | None):
+    if cache_key: MEDIA_CACHE.release(cache_key); return
+    TRANSFER.release(path, thumb_path)
+
+# --- Album Assembly ---
+# Album parts arrive as separate NewMessage events. Each album is flushed as soon
+# as no new part has arrived for ALBUM_QUIET_SECONDS (the timer restarts on every
+# part), or ALBUM_MAX_WAIT after its first part, whichever comes first.
+
+class AlbumAssembler:
+    def __init__(self, on_flush, quiet: float, max_wait: float):
+        self.on_flush, self.quiet, self.max_wait = on_flush, quiet, max_wait
+        self.buffers: dict = {}
+
+    def add(self, key, message: Message, tasks: list[CompiledTask]):
+        """Buffers `message` once under `key` and records which of `tasks` accepted it.
+        On flush, on_flush(messages, task_parts) runs with task_parts = {task_id: (task, accepted_ids)}."""
+        loop = asyncio.get_running_loop()
+        buffer = self.buffers.get(key)
+        if buffer is None:
+            buffer = self.buffers[key] = {"messages": {}, "tasks": {}, "started": loop.time(), "timer": None}
+        else:
+            buffer["timer"].cancel()
+        buffer["messages"][message.id] = message
+        for task in tasks: buffer["tasks"].setdefault(task.id, (task, set()))[1].add(message.id)
+        wait = min(self.quiet, buffer["started"] + self.max_wait - loop.time())
+        buffer["timer"] = loop.call_later(max(0.0, wait), self._flush, key)
+
+    def _flush(self, key):
+        buffer = self.buffers.pop(key)
+        latency = asyncio.get_running_loop().time() - buffer["started"]
+        for task_id in buffer["tasks"]: METRICS.observe("album_wait", latency, task=task_id)
+        LOGGER.info(f"Album {key} assembled: {len(buffer['messages'])} parts in {latency:.2f}s")
+        spawn(self.on_flush(sorted(buffer["messages"].values(), key=lambda m: m.id), buffer["tasks"]))
+
+# --- Dedup Index ---
+# The same post often arrives from several mirrored sources. Each (destination,
+# content) pair is claimed once per DEDUP_TTL_HOURS before anything is downloaded;
+# content is the media's Telegram IDs plus a hash of the normalized caption.
+# Text-only posts are never suppressed. The oldest claims are dropped past DEDUP_MAX_ENTRIES.
+
+class DedupIndex:
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries, self.ttl = max_entries, ttl
+        self.entries: OrderedDict[tuple, float] = OrderedDict()  # (dest_id, key) -> expiry, soonest first
+        self.hits, self.misses = 0, 0
+
+    @staticmethod
+    def content_key(messages: list[Message]) -> str | None:
+        media = [m.document or m.photo for m in messages]
+        if not media or not all(media): return None
+        caption = " ".join(next((m.text for m in messages if m.text), "").lower().split())
+        return ",".join(str(item.id) for item in media) + ":" + hashlib.blake2b(caption.encode(), digest_size=8).hexdigest()
+
+    def claim(self, dest_id: int, key: str | None) -> bool:
+        """Returns False if `key` was already sent to `dest_id` within the TTL, otherwise records it and returns True."""
+        if key is None or self.max_entries <= 0: return True
+        now = time.monotonic()
+        expiry = self.entries.get((dest_id, key))
+        if expiry and expiry > now:
+            self.hits += 1; return False
+        self.misses += 1
+        self.entries[(dest_id, key)] = now + self.ttl; self.entries.move_to_end((dest_id, key))
+        while self.entries and (len(self.entries) > self.max_entries or next(iter(self.entries.values())) <= now):
+            self.entries.popitem(last=False)
+        return True
+
+    def forget(self, dest_id: int, key: str | None):
+        # Lets a delivery that failed before sending be claimed again when it is retried
+        if key is not None: self.entries.pop((dest_id, key), None)
+
+DEDUP = DedupIndex(DEDUP_MAX_ENTRIES, DEDUP_TTL_HOURS * 3600)
+
+# --- Delivery Queue ---
+# The NewMessage handler only records a job (source chat, message ID, task IDs);
+# jobs are persisted to `delivery_queue` in one insert_many per round trip, then
+# delivered by up to QUEUE_MAX_INFLIGHT concurrent runs. A job is acknowledged once
+# every destination has it: marked "acked", then deleted. If any send fails, the
+# job is retried with backoff for the destinations still missing (its "done" list
+# records the rest) and marked "failed" after QUEUE_MAX_ATTEMPTS. Jobs neither
+# acked nor failed at startup are redelivered.
+
+class DeliveryError(Exception):
+    """Some of a job's destinations were not reached; the job is retried for them."""
+
+class DeliveryQueue:
+    def __init__(self, collection, deliver, max_inflight: int, max_attempts: int):
+        self.collection, self.deliver, self.max_attempts = collection, deliver, max_attempts
+        self.incoming: list[tuple[dict, Message]] = []  # received, not yet persisted
+        self.acks: list[str] = []
+        self.touched: dict = {}  # sources whose replay ranges changed with no job to carry them
+        self.jobs: dict[str, dict] = {}  # persisted and not yet acknowledged
+        self.ready: asyncio.Queue = asyncio.Queue()
+        self.slots = asyncio.Semaphore(max_inflight)
+        self.wakeup = asyncio.Event()
+
+    @staticmethod
+    def job_id(message: Message) -> str:
+        return f"{normalize_chat_id(message.chat_id)}:{message.id}"
+
+    def put(self, message: Message, task_ids: list):
+        """Records a job for `message` and returns at once; it is persisted and delivered in the background."""
+        doc = {"_id": self.job_id(message), "chat_id": message.chat_id, "message_id": message.id, "task_ids": task_ids, "attempts": 0, "created_at": datetime.utcnow()}
+        self.incoming.append((doc, message)); self.wakeup.set()
+
+    def touch(self, source: int, chat_id):
+        # Writes `source`'s replay ranges with the next flush, behind any job still being persisted
+        self.touched[source] = (chat_id, 0); self.wakeup.set()
+
+    def ack(self, job_id: str):
+        if self.jobs.pop(job_id, None) is not None: self.acks.append(job_id); self.wakeup.set()
+
+    def retry(self, job_id: str, message: Message, error: Exception):
+        job = self.jobs.get(job_id)
+        if job is None: return
+        job["attempts"] += 1
+        if job["attempts"] >= self.max_attempts:
+            LOGGER.error(f"Giving up on job {job_id} after {job['attempts']} attempts: {error}")
+            del self.jobs[job_id]
+            for task_id in job["task_ids"]: update_stats(task_id, success=False)
+            spawn(self.collection.update_one({"_id": job_id}, {"$set": {"status": "failed", "error": str(error)}}))
+            return
+        delay = min(RETRY_MAX_BACKOFF, 2 ** job["attempts"])
+        LOGGER.warning(f"Job {job_id} failed ({error}); redelivering in {delay}s")
+        spawn(self.collection.update_one({"_id": job_id}, {"$set": {"attempts": job["attempts"], "done": job.get("done", [])}}))
+        asyncio.get_running_loop().call_later(delay, self.ready.put_nowait, (job, message))
+
+    async def flush(self):
+        incoming, self.incoming = self.incoming, []
+        acks, self.acks = self.acks, []
+        marks, self.touched = self.touched, {}
+        duplicates, persisted = set(), {}
+        if incoming:
+            try:
+                await self.collection.insert_many([doc for doc, _ in incoming], ordered=False); stored = True
+            except BulkWriteError as e:
+                # Already queued: a repeated update for a message that is still pending
+                duplicates = {err["index"] for err in e.details.get("writeErrors", []) if err.get("code") == 11000}; stored = True
+            except Exception as e:
+                LOGGER.error(f"Failed to persist {len(incoming)} queued jobs, delivering them anyway: {e}"); stored = False
+            for i, (doc, message) in enumerate(incoming):
+                chat = normalize_chat_id(doc["chat_id"])
+                marks[chat] = (doc["chat_id"], max(doc["message_id"], marks.get(chat, (0, 0))[1]))
+                if stored: persisted.setdefault(chat, []).append(doc["message_id"])
+                if i in duplicates or doc["_id"] in self.jobs: continue
+                self.jobs[doc["_id"]] = doc; self.ready.put_nowait((doc, message))
+        if marks: await self.advance_marks(marks, persisted)
+        if acks:
+            # Marked first, so a job whose delete is lost (crash, error) isn't redelivered by recover()
+            try:
+                await self.collection.update_many({"_id": {"$in": acks}}, {"$set": {"status": "acked"}})
+                await self.collection.delete_many({"_id": {"$in": acks}})
+            except Exception as e:
+                LOGGER.error(f"Failed to acknowledge {len(acks)} jobs: {e}"); self.acks.extend(acks)
+
+    async def advance_marks(self, marks: dict, persisted: dict):
+        # Per-source high-water mark; $max keeps it from moving backwards. The ranges catch_up() has yet to
+        # replay go in the same update, so the mark never moves past one without it being recorded
+        ops = []
+        for chat, (chat_id, last_id) in marks.items():
+            update = {"$max": {"last_message_id": last_id}, "$set": {"chat_id": chat_id}}
+            if chat in SOURCE_GAPS: update["$set"]["gaps"] = advance_gaps(chat, persisted.get(chat, ()))
+            ops.append(UpdateOne({"_id": chat}, update, upsert=True))
+        try: await source_state_collection.bulk_write(ops, ordered=False)
+        except Exception as e: LOGGER.error(f"Failed to update source high-water marks: {e}")
+
+    async def run(self):
+        # Jobs received while a flush is in flight are persisted together by the next one
+        while True:
+            await self.wakeup.wait(); self.wakeup.clear()
+            await self.flush()
+
+    async def dispatch(self):
+        while True:
+            job, message = await self.ready.get()
+            await self.slots.acquire()
+            spawn(self._process(job, message))
+
+    async def _process(self, job: dict, message: Message):
+        try:
+            if await self.deliver(job, message): self.ack(job["_id"])
+        except Exception as e:
+            self.retry(job["_id"], message, e)
+        finally:
+            self.slots.release()
+
+    async def recover(self):
+        """Redelivers jobs left in the collection by a previous run; call once the client is connected."""
+        by_chat: dict = {}
+        try: await self.collection.delete_many({"status": "acked"})
+        except Exception as e: LOGGER.error(f"Failed to clear acknowledged jobs: {e}")
+        async for job in self.collection.find({"status": {"$nin": ["failed", "acked"]}}).sort("created_at", 1):
+            if job["_id"] not in self.jobs: by_chat.setdefault(job["chat_id"], []).append(job)
+        for chat_id, jobs in by_chat.items():
+            for i in range(0, len(jobs), 100):
+                chunk = jobs[i:i + 100]
+                try: messages = await BACKOFF.call(lambda: POOL.listener(chat_id).get_messages(chat_id, ids=[j["message_id"] for j in chunk]), session=POOL.listener(chat_id))
+                except Exception as e:
+                    LOGGER.error(f"Could not fetch {len(chunk)} queued messages from {chat_id}: {e}"); continue
+                for job, message in zip(chunk, messages):
+                    self.jobs[job["_id"]] = job
+                    if message is None: self.ack(job["_id"])  # deleted at the source
+                    else: self.ready.put_nowait((job, message))
+        if by_chat: LOGGER.info(f"Redelivering {sum(map(len, by_chat.values()))} queued messages from the last run.")
+
+# --- Catch-up Backfill ---
+# NewMessage only sees live updates, so whatever a source posted while the process
+# was down is fetched on startup: everything between the source's high-water mark
+# and the first live message, oldest first, queued exactly like live messages.
+# Live messages move the high-water mark past that range at once, so the range is
+# kept in the source's `gaps` ([after_id, before_id], before_id None until the first
+# live message) and its start only moves as replayed jobs are persisted; a replay cut
+# short by a restart resumes from there. It is paced by BACKFILL_RATE and backs off
+# while live deliveries are busy.
+
+FIRST_LIVE_ID: dict[int, int] = {}  # normalized source ID -> first message handle_new_message saw
+SOURCE_GAPS: dict[int, list[list]] = {}  # normalized source ID -> [after_id, before_id] ranges not yet replayed
+
+def advance_gaps(source: int, message_ids) -> list[list]:
+    """Closes `source`'s open range at its first live message and moves range starts past persisted `message_ids`."""
+    gaps = SOURCE_GAPS[source]
+    for gap in gaps:
+        if gap[1] is None and source in FIRST_LIVE_ID: gap[1] = FIRST_LIVE_ID[source]
+        # Replayed oldest first, so everything up to the newest persisted ID is queued
+        gap[0] = max([gap[0]] + [i for i in message_ids if gap[0] < i < (gap[1] or float("inf"))])
+    return gaps
+
+async def load_source_marks() -> list[dict]:
+    """Snapshots the high-water marks of indexed sources and records the range each has to replay;
+    call before live handling starts moving them."""
+    states = [state async for state in source_state_collection.find({"_id": {"$in": list(set(SOURCE_KEYS.values()))}})]
+    for state in states:
+        # A range left open by a run that stopped before its first live message ends at its high-water mark
+        gaps = [[after, before if before is not None else state["last_message_id"] + 1] for after, before in state.get("gaps", [])]
+        SOURCE_GAPS[state["_id"]] = gaps + [[state["last_message_id"], None]]
+    return states
+
+async def catch_up_source(state: dict, bucket: TokenBucket) -> int:
+    source, chat_id, queued = state["_id"], state["chat_id"], 0
+    for gap in list(SOURCE_GAPS[source]):
+        queued += await replay_gap(source, chat_id, gap, bucket)
+        SOURCE_GAPS[source] = [g for g in SOURCE_GAPS[source] if g is not gap]; QUEUE.touch(source, chat_id)
+    return queued
+
+async def replay_gap(source: int, chat_id, gap: list, bucket: TokenBucket) -> int:
+    last_id, queued = gap[0], 0
+    while True:
+        page = await BACKOFF.call(lambda: POOL.listener(chat_id).get_messages(chat_id, limit=CLONE_PAGE_SIZE, min_id=last_id, reverse=True), session=POOL.listener(chat_id))
+        if not page: return queued
+        for message in page:
+            # From here on the live handler (or a later range) has it
+            if message.id >= (gap[1] or FIRST_LIVE_ID.get(source, float("inf"))): return queued
+            last_id = message.id
+            tasks = TASK_INDEX.get(source)
+            if not tasks or message.action: continue
+            while len(QUEUE.jobs) > BACKFILL_MAX_BACKLOG: await asyncio.sleep(1)
+            while (wait := bucket.try_acquire()) > 0: await asyncio.sleep(wait)
+            QUEUE.put(message, [task.id for task in tasks]); queued += 1
+
+async def catch_up(marks: list[dict]):
+    bucket = TokenBucket(BACKFILL_RATE, max(1, int(BACKFILL_RATE)))
+    for state in marks:
+        try: queued = await catch_up_source(state, bucket)
+        except Exception as e:
+            LOGGER.error(f"Catch-up for {state['chat_id']} failed: {e}"); continue
+        if queued: LOGGER.info(f"Caught up {queued} messages posted to {state['chat_id']} while offline.")
 
 # --- Telethon Client (Userbot) ---
 
-ALBUM_BUFFER = {} 
-ALBUM_LOCKS = {}
+def is_video_message(message: Message) -> bool:
+    return bool(message.video or (message.document and (message.file.mime_type or "").startswith('video/')))
+
+async def prepare_message(message: Message) -> tuple:
+    """Fetches and uploads `message`'s media once; returns (path, thumb_path, cache_key, media) for fan_out_message()."""
+    path, thumb_path, cache_key = await fetch_media(message)
+    try: media = await upload_media(path) if path else None
+    except BaseException:
+        release_media(path, thumb_path, cache_key); raise
+    return path, thumb_path, cache_key, media
+
+def can_copy_by_reference(message: Message) -> bool:
+    # Media from chats without content protection can be re-sent by its file reference, with no download
+    return bool(message.media) and not message.noforwards and not isinstance(message.media, MessageMediaWebPage)
 
-async def process_single_message(dest_id: int, message: Message, caption: str, task_id: str = None):
-    path, thumb_path = None, None
+async def fan_out_message(message: Message, targets: list[tuple[int, str, str | None, float]], prepared: tuple | None = None, copy: bool = False, failed: list | None = None) -> int:
+    """Sends `message` to every (dest_id, caption, task_id, not_before) target, fetching and uploading it once
+    unless `prepared` by prepare_message(). With `copy`, media is re-sent by reference when the source allows it.
+    Returns the number of targets it was delivered to. Given a `failed` list, undelivered targets are appended
+    to it and left out of the stats, for the caller to retry."""
+    if copy and not prepared and can_copy_by_reference(message):
+        prepared = (None, None, None, message.media)
     try:
-        if message.media:
-            # Optimized download
-            path = await message.download_media(file=f"temp_single_{message.id}")
-            is_video = message.video or (message.document and message.file.mime_type.startswith('video/'))
-            if is_video: thumb_path = await generate_thumbnail(path)
-
-        await client.send_file(dest_id, path or message.text, caption=caption, thumb=thumb_path, link_preview=False)
-        if task_id: update_stats(task_id, success=True)
+        path, thumb_path, cache_key, media = prepared or await prepare_message(message)
     except Exception as e:
-        LOGGER.error(f"❌ Failed to copy single message to {dest_id}: {e}")
-        if task_id: update_stats(task_id, success=False)
+        LOGGER.error(f"❌ Failed to fetch media for message {message.id}: {e}")
+        if failed is not None: failed.extend(targets); return 0
+        for _, _, task_id, _ in targets:
+            if task_id: update_stats(task_id, success=False)
+        return 0
+
+    attributes = message.document.attributes if message.document else None
+    restricted = []  # targets refused a by-reference copy; they fall back to download and upload
+    # The upload (or, when copying, the source's own reference) belongs to one session; others make their own
+    uploads = SessionUploads(client if path else getattr(message, "client", None) or client, {message.id: media}, {message.id: path}) if media else None
+
+    async def deliver(target):
+        dest_id, caption, task_id, not_before = target
+
+        async def send(session):
+            if not uploads: return await session.send_message(dest_id, caption, link_preview=False)
+            file = await uploads.get(session, message.id)
+            sent = await session.send_file(dest_id, file, caption=caption, thumb=thumb_path, attributes=attributes, link_preview=False)
+            if sent and sent.media: uploads.sent(session, message.id, sent.media)
+            return sent
+        try:
+            # A task's configured delay is not latency; the clock starts when the message is due
+            with METRICS.timed("deliver", task_id or "", dest_id, start=not_before):
+                # A session's first upload happens here, not in the send job, so it holds no worker or chat slot
+                if uploads: await uploads.get(POOL.sender(dest_id), message.id)
+                sent = await SCHEDULER.submit(dest_id, send, not_before)
+            if task_id: update_stats(task_id, success=True)
+            return sent
+        except Exception as e:
+            if uploads and path is None and isinstance(e, (ChatForwardsRestrictedError, NotOnSession)):
+                restricted.append(target); return None
+            LOGGER.error(f"❌ Failed to copy single message to {dest_id}: {e}")
+            if failed is not None: failed.append(target)
+            elif task_id: update_stats(task_id, success=False)
+
+    try:
+        first, *rest = sorted(targets, key=lambda t: t[3])
+        # Later destinations reuse the first one's server-side copy instead of the upload handle
+        results = [await deliver(first), *await asyncio.gather(*(deliver(t) for t in rest))]
+        delivered = sum(result is not None for result in results)
     finally:
-        if path and os.path.exists(path): os.remove(path)
-        if thumb_path and os.path.exists(thumb_path): os.remove(thumb_path)
-
-async def process_album_batch(task_id, group_id, dest_ids, mods):
-    await asyncio.sleep(4) # Wait for all parts
-    messages = ALBUM_BUFFER.pop(group_id, [])
-    if group_id in ALBUM_LOCKS: del ALBUM_LOCKS[group_id]
-    if not messages: return
-    
-    messages.sort(key=lambda x: x.id)
-    paths, thumb_path = [], None
-    
-    # Find caption
-    raw_caption = ""
-    for msg in messages:
-        if msg.text:
-            raw_caption = msg.text
-            break
-    final_caption = apply_text_modifications(raw_caption, mods)
+        release_media(path, thumb_path, cache_key)
+    if restricted: delivered += await fan_out_message(message, restricted, failed=failed)
+    return delivered
 
+async def process_single_message(dest_id: int, message: Message, caption: str, task_id: str = None) -> bool:
+    return await fan_out_message(message, [(dest_id, caption, task_id, 0.0)]) > 0
+
+async def prepare_album(messages: list[Message], copy: bool = False) -> tuple:
+    """Fetches and uploads each album part once; returns (fetched, files, thumb_path) for send_album().
+    With `copy`, parts are referenced by their existing media when the source allows it."""
+    fetched, files, thumb_path = {}, {}, None
+    if copy and all(can_copy_by_reference(m) for m in messages):
+        return fetched, {m.id: m.media for m in messages}, thumb_path
     try:
-        for i, msg in enumerate(messages):
-            path = await msg.download_media(file=f"temp_{task_id}_{group_id}_{i}")
-            paths.append(path)
-            is_video = msg.video or (msg.document and msg.file.mime_type.startswith('video/'))
-            if not thumb_path and is_video: thumb_path = await generate_thumbnail(path)
-        
-        for dest_id in dest_ids:
-            await client.send_file(dest_id, paths, caption=final_caption, thumb=thumb_path, link_preview=False)
-        update_stats(task_id, success=True)
-    except Exception as e:
-        LOGGER.error(f"Error processing album {group_id}: {e}")
-        update_stats(task_id, success=False)
+        for msg in messages:
+            fetched[msg.id] = await fetch_media(msg, with_thumb=not thumb_path and is_video_message(msg))
+            path, thumb_path = fetched[msg.id][0], thumb_path or fetched[msg.id][1]
+            if path: files[msg.id] = await upload_media(path)
+    except BaseException:
+        for item in fetched.values(): release_media(*item)
+        raise
+    return fetched, files, thumb_path
+
+async def send_album(group_id, deliveries: list[tuple], prepared: tuple, messages: list[Message], failed: list | None = None) -> int:
+    """Sends a prepared album of `messages` to each (task_id, dest_id, part_ids, caption) delivery and releases
+    its media. Returns the number of deliveries that succeeded; `failed` works as in fan_out_message()."""
+    fetched, files, thumb_path = prepared
+    restricted = []  # deliveries refused a by-reference copy; they fall back to download and upload
+    uploads = SessionUploads(client if fetched else getattr(messages[0], "client", None) or client, files, {i: item[0] for i, item in fetched.items()})
+
+    async def deliver(task_id, dest_id, ids, caption):
+        async def send(session):
+            # Handles are looked up when the job runs, so later sends pick up media already on Telegram's servers
+            sent = await session.send_file(dest_id, await asyncio.gather(*(uploads.get(session, i) for i in ids)), caption=caption, thumb=thumb_path, link_preview=False)
+            for i, sent_msg in zip(ids, sent or []):
+                if sent_msg and sent_msg.media: uploads.sent(session, i, sent_msg.media)
+            return sent
+        try:
+            with METRICS.timed("deliver", task_id or "", dest_id):
+                await asyncio.gather(*(uploads.get(POOL.sender(dest_id), i) for i in ids))  # as in fan_out_message()
+                await SCHEDULER.submit(dest_id, send)
+            if task_id: update_stats(task_id, success=True)
+            return True
+        except Exception as e:
+            if not fetched and isinstance(e, (ChatForwardsRestrictedError, NotOnSession)):
+                restricted.append((task_id, dest_id, ids, caption)); return False
+            LOGGER.error(f"Error sending album {group_id} to {dest_id}: {e}")
+            if failed is not None: failed.append((task_id, dest_id, ids, caption))
+            elif task_id: update_stats(task_id, success=False)
+            return False
+
+    try:
+        if not deliveries: return 0
+        results = [await deliver(*deliveries[0]), *await asyncio.gather(*(deliver(*d) for d in deliveries[1:]))]
+        delivered = sum(results)
     finally:
-        for path in paths:
-            if os.path.exists(path): os.remove(path)
-        if thumb_path and os.path.exists(thumb_path): os.remove(thumb_path)
+        for item in fetched.values(): release_media(*item)
+    if not restricted: return delivered
+    wanted = {i for _, _, ids, _ in restricted for i in ids}
+    try: prepared = await prepare_album([m for m in messages if m.id in wanted])
+    except Exception as e:
+        LOGGER.error(f"Error fetching album {group_id}: {e}")
+        if failed is not None: failed.extend(restricted); return delivered
+        for task_id, *_ in restricted:
+            if task_id: update_stats(task_id, success=False)
+        return delivered
+    restricted = [(task_id, dest_id, [i for i in ids if i in prepared[1]], caption) for task_id, dest_id, ids, caption in restricted]
+    return delivered + await send_album(group_id, [d for d in restricted if d[2]], prepared, messages, failed)
+
+async def process_album_batch(messages: list[Message], task_parts: dict, done=()) -> tuple[list, list]:
+    """Downloads and uploads an album once, then sends every task its accepted parts
+    with the task's own caption modifications and destinations, skipping the "task:dest"
+    deliveries in `done`. Returns the (task, dest_id) pairs it delivered and those that failed."""
+    plans = []
+    for task_id, (task, ids) in task_parts.items():
+        parts = [m for m in messages if m.id in ids]
+        key = DEDUP.content_key(parts)
+        for dest_id in task.dest_ids:
+            if f"{task_id}:{dest_id}" in done: continue
+            if DEDUP.claim(dest_id, key): plans.append((task, dest_id, parts, key))
+            else: STATS.record(task_id, "total_duplicates")
+    if not plans: return [], []
+
+    wanted = {m.id for _, _, parts, _ in plans for m in parts}
+    try: prepared = await prepare_album([m for m in messages if m.id in wanted], copy=all(task.copy_mode for task, *_ in plans))
+    except BaseException:
+        for _, dest_id, _, key in plans: DEDUP.forget(dest_id, key)
+        raise
+
+    files, deliveries = prepared[1], []
+    for task, dest_id, parts, _ in plans:
+        parts = [m for m in parts if m.id in files]
+        if parts: deliveries.append((task.id, dest_id, [m.id for m in parts], task.caption(next((m.text for m in parts if m.text), ""))))
+    failed = []
+    await send_album(messages[0].grouped_id, deliveries, prepared, messages, failed)
+    failed = {(task_id, dest_id) for task_id, dest_id, *_ in failed}
+    for task, dest_id, _, key in plans:
+        if (task.id, dest_id) in failed: DEDUP.forget(dest_id, key)
+    return [(task, dest_id) for task, dest_id, *_ in plans if (task.id, dest_id) not in failed], [(task, dest_id) for task, dest_id, *_ in plans if (task.id, dest_id) in failed]
+
+async def deliver_album(messages: list[Message], task_parts: dict):
+    # Album parts are acknowledged together once the album has reached every destination
+    jobs = [QUEUE.jobs.get(QUEUE.job_id(m)) or {} for m in messages]
+    try:
+        delivered, failed = await process_album_batch(messages, task_parts, {d for job in jobs for d in job.get("done", [])})
+        for job in jobs: job.setdefault("done", []).extend(f"{task.id}:{dest_id}" for task, dest_id in delivered)
+        if failed: raise DeliveryError(f"{len(failed)} of {len(delivered) + len(failed)} album sends failed")
+    except Exception as e:
+        LOGGER.error(f"Error delivering album {messages[0].grouped_id}: {e}")
+        for m in messages: QUEUE.retry(QUEUE.job_id(m), m, e)
+    else:
+        for m in messages: QUEUE.ack(QUEUE.job_id(m))
+
+async def deliver_job(job: dict, message: Message) -> bool:
+    """Runs a queued message through its tasks' filters and modifications and sends it. Returns False
+    when the message went to the album assembler, which acknowledges the job itself, and raises
+    DeliveryError if any destination wasn't reached."""
+    task_ids, done = set(job["task_ids"]), set(job.get("done", []))  # "task:dest" deliveries made by earlier attempts
+    tasks = [task for task in TASK_INDEX.get(job["chat_id"], ()) if task.id in task_ids]
+    targets, copy_targets, album_tasks = [], [], []
+    is_video, text_lower = is_video_message(message), (message.text or "").lower()
+    key = None if message.grouped_id else DEDUP.content_key([message])
+    for task in tasks:
+        with METRICS.timed("filter", task.id): accepted = task.accepts(message, is_video, text_lower)
+        if not accepted: continue
+        if message.grouped_id:
+            album_tasks.append(task); continue
+        pending = [dest_id for dest_id in task.dest_ids if f"{task.id}:{dest_id}" not in done]
+        dest_ids = [dest_id for dest_id in pending if DEDUP.claim(dest_id, key)]
+        for _ in range(len(pending) - len(dest_ids)): STATS.record(task.id, "total_duplicates")
+        if not dest_ids: continue
+        final_caption = task.caption(message.text)
+        not_before = SCHEDULER.reserve(task.id, task.delay) if task.delay > 0 else 0.0
+        (copy_targets if task.copy_mode else targets).extend((dest_id, final_caption, task.id, not_before) for dest_id in dest_ids)
+
+    if album_tasks: ALBUMS.add((normalize_chat_id(job["chat_id"]), message.grouped_id), message, album_tasks)
+    # Fetched here rather than inside fan_out_message so a failed download raises and the job is redelivered
+    try: prepared = await prepare_message(message) if targets else None
+    except BaseException:
+        for dest_id, *_ in targets + copy_targets: DEDUP.forget(dest_id, key)
+        raise
+    failed = []
+    await asyncio.gather(*([fan_out_message(message, targets, prepared, failed=failed)] if targets else []),
+                         *([fan_out_message(message, copy_targets, copy=True, failed=failed)] if copy_targets else []))
+    # Targets that got the message aren't sent it again when the job is retried for the others
+    undelivered = {(dest_id, task_id) for dest_id, _, task_id, _ in failed}
+    job.setdefault("done", []).extend(f"{task_id}:{dest_id}" for dest_id, _, task_id, _ in targets + copy_targets if (dest_id, task_id) not in undelivered)
+    if failed:
+        for dest_id, *_ in failed: DEDUP.forget(dest_id, key)
+        raise DeliveryError(f"{len(failed)} of {len(targets) + len(copy_targets)} sends failed")
+    return not album_tasks
+
+ALBUMS = AlbumAssembler(deliver_album, ALBUM_QUIET_SECONDS, ALBUM_MAX_WAIT)
+QUEUE = DeliveryQueue(queue_collection, deliver_job, QUEUE_MAX_INFLIGHT, QUEUE_MAX_ATTEMPTS)
 
 # Initialize Client with optimizations
-client = TelegramClient(SESSION_NAME, int(API_ID), API_HASH)
+client = TelegramClient(SESSION_NAME, int(API_ID), API_HASH, flood_sleep_threshold=FLOOD_SLEEP_THRESHOLD)
 
 @client.on(events.NewMessage())
 async def handle_new_message(event):
     if not MY_ID: return
-    message = event.message
-    chat_id = event.chat_id
+    with METRICS.timed("route"): active_tasks = TASK_INDEX.get(event.chat_id)
+    if not active_tasks: return
+    # Every pool account in the source receives the post; only the source's listener queues it
+    if POOL.extra and event.client is not POOL.listener(event.chat_id): return
+    FIRST_LIVE_ID.setdefault(SOURCE_KEYS[event.chat_id], event.message.id)
+    QUEUE.put(event.message, [task.id for task in active_tasks])
 
-    clean_id = int(str(chat_id).replace("-100", ""))
-    possible_ids = [chat_id, clean_id, int(f"-100{clean_id}")]
+# --- Session Pool ---
+# Extra user accounts (SESSION_POOL session files or StringSessions, plus {"_id": name,
+# "string_session": ..., "enabled": true} documents in `sessions`) share the sending.
+# A StringSession is a login secret: it is only ever named by a hash of its value. Destinations map to
+# sessions on a consistent-hash ring, so adding or removing an account moves only its
+# share; a destination whose session is in an account-wide FloodWait goes to the next
+# healthy one on the ring until the wait is over. Each source is listened to by exactly
+# one session: the first on the ring that is still a member of it. Memberships are
+# re-checked every SESSION_CHECK_SECONDS, and a session that disconnects leaves the
+# ring; a source whose listener changes gets what it missed replayed like a startup
+# catch-up. Every account must be able to post in the destinations it may be given.
 
-    active_tasks = list(tasks_collection.find({"source_ids": {"$in": possible_ids}, "status": "active"}))
-    if not active_tasks: return
+class NotOnSession(Exception):
+    """The media was only referenced from the source, and the sending session can't use that reference."""
 
-    for task in active_tasks:
-        block_me = task.get("settings", {}).get("block_me", False)
-        if block_me and message.sender_id == task.get("owner_id") and not message.reply_to: continue
+class SessionUploads:
+    """Upload handles for prepared files, per pool session. A handle or file reference is only valid
+    for the account that made it, so other sessions upload their own copy of the local file on first use.
+    Callers get() the handle for the destination's sender before submitting the send, so uploads run
+    outside the scheduler; a send rerouted to another session uploads inside its job."""
+    def __init__(self, session, handles: dict, files: dict):
+        self.handles = {session: dict(handles)}  # session -> {key: handle}
+        self.files = files  # key -> local file; None when the media was only referenced
+        self.uploads: dict = {}  # (session, key) -> upload task
 
-        filters_doc = task.get("filters", {})
-        msg_text = message.text or ""
-        is_video = message.video or (message.document and message.file.mime_type.startswith('video/'))
-        
-        if filters_doc.get("block_videos") and is_video: continue
-        if filters_doc.get("block_photos") and message.photo: continue
-        if filters_doc.get("block_documents") and message.document and not is_video: continue
-        if filters_doc.get("block_text") and not message.media: continue
-
-        blacklist = filters_doc.get("blacklist_words")
-        if blacklist:
-            if any(w.lower() in msg_text.lower() for w in blacklist.splitlines() if w.strip()): continue
-        
-        whitelist = filters_doc.get("whitelist_words")
-        if whitelist:
-             if not any(w.lower() in msg_text.lower() for w in whitelist.splitlines() if w.strip()): continue
+    async def get(self, session, key):
+        handles = self.handles.setdefault(session, {})
+        if key not in handles:
+            if (session, key) not in self.uploads:
+                file = self.files.get(key)
+                if file is None: raise NotOnSession(key)
+                if isinstance(file, io.BytesIO):  # a fresh stream; an earlier upload has read this one
+                    file, name = io.BytesIO(file.getbuffer()), file.name; file.name = name
+                self.uploads[(session, key)] = spawn(upload_media(file, session))
+            handles[key] = await asyncio.shield(self.uploads[(session, key)])
+        return handles[key]
 
-        mods = task.get("modifications", {})
-        dest_ids = task.get("destination_ids", [])
-        
-        if message.grouped_id:
-            group_id = message.grouped_id
-            if group_id not in ALBUM_BUFFER: ALBUM_BUFFER[group_id] = []
-            ALBUM_BUFFER[group_id].append(message)
-            if group_id not in ALBUM_LOCKS:
-                ALBUM_LOCKS[group_id] = asyncio.create_task(process_album_batch(task['_id'], group_id, dest_ids, mods))
-            continue 
-        else:
-            final_caption = apply_text_modifications(msg_text, mods)
-            for dest_id in dest_ids:
-                await process_single_message(dest_id, message, final_caption, task['_id'])
-            
-            delay = task.get("settings", {}).get("delay", 0)
-            if delay > 0: await asyncio.sleep(delay)
+    def sent(self, session, key, media):
+        self.handles.setdefault(session, {})[key] = media
+
+class HashRing:
+    def __init__(self, nodes: list[str], replicas: int):
+        self.points = sorted((self.hash(f"{node}#{i}"), node) for node in nodes for i in range(replicas))
+        self.hashes = [h for h, _ in self.points]
+
+    @staticmethod
+    def hash(value) -> int:
+        return int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), "big")
+
+    def walk(self, key):
+        """Yields every node once, in ring order from `key`'s position."""
+        start, seen = bisect.bisect(self.hashes, self.hash(key)), set()
+        for i in range(len(self.points)):
+            node = self.points[(start + i) % len(self.points)][1]
+            if node not in seen: seen.add(node); yield node
+
+class SessionPool:
+    def __init__(self, replicas: int):
+        self.replicas = replicas
+        self.extra: dict[str, TelegramClient] = {}  # name -> connected client; the primary `client` is implicit
+        self.ring = HashRing([SESSION_NAME], replicas)
+        self.listeners: dict[int, str] = {}  # every source ID form -> listening session's name
+        self.owners: dict[int, str] = {}  # normalized source ID -> listening session's name, as last assigned
+        self.assigning = asyncio.Lock()
+        self.stopping = False
+
+    def session(self, name: str) -> TelegramClient:
+        return self.extra.get(name) or client
+
+    def name(self, session) -> str:
+        return next((name for name, extra in self.extra.items() if extra is session), SESSION_NAME)
+
+    def sender(self, dest_id) -> TelegramClient:
+        """The destination's session on the ring, skipping accounts in FloodWait (or the one free soonest)."""
+        if not self.extra: return client
+        best, best_wait = client, float("inf")
+        for name in self.ring.walk(normalize_chat_id(dest_id)):
+            session = self.session(name)
+            wait = BACKOFF.parked_for(session=session)
+            if wait <= 0: return session
+            if wait < best_wait: best, best_wait = session, wait
+        return best
+
+    def listener(self, chat_id) -> TelegramClient:
+        return self.session(self.listeners.get(chat_id, SESSION_NAME))
+
+    @staticmethod
+    def pool_entry(entry: str) -> tuple:
+        """(name, session) for a SESSION_POOL entry: an existing session file, else a StringSession."""
+        if os.path.exists(entry if entry.endswith(".session") else entry + ".session"): return entry, entry
+        return f"session-{hashlib.blake2b(entry.encode(), digest_size=4).hexdigest()}", StringSession(entry)
+
+    async def start(self):
+        configs = []
+        for i, entry in enumerate(SESSION_POOL, 1):
+            try: configs.append(self.pool_entry(entry))
+            except Exception: LOGGER.error(f"SESSION_POOL entry {i} is neither a session file nor a valid StringSession; skipped.")
+        try: configs += [(doc["_id"], StringSession(doc["string_session"])) async for doc in sessions_collection.find({"enabled": {"$ne": False}})]
+        except Exception as e: LOGGER.error(f"Could not load pool sessions from MongoDB: {e}")
+        accounts = {(await BACKOFF.call(client.get_me)).id}
+        for name, session_config in configs:
+            session = TelegramClient(session_config, int(API_ID), API_HASH, flood_sleep_threshold=FLOOD_SLEEP_THRESHOLD)
+            try:
+                await session.connect()
+                if not await session.is_user_authorized(): raise RuntimeError("not logged in")
+                me = await BACKOFF.call(session.get_me, session=session)
+                if me.id in accounts: raise RuntimeError("same account as another session")
+            except Exception as e:
+                LOGGER.error(f"Pool session {name} skipped: {e}"); await session.disconnect(); continue
+            accounts.add(me.id)
+            session.add_event_handler(handle_new_message, events.NewMessage())
+            self.extra[name] = session; spawn(self.watch_connection(name, session))
+            try: await warm_up_entities(session)
+            except Exception as e: LOGGER.warning(f"Entity warm-up for {name} failed: {e}")
+        self.ring = HashRing([SESSION_NAME, *self.extra], self.replicas)
+        if self.extra: LOGGER.info(f"Session pool: {len(self.extra) + 1} accounts."); spawn(self.recheck())
+        await self.assign_sources()
+
+    async def is_member(self, name: str, chat_id) -> bool:
+        # get_input_entity still works from a cached access hash after the account left; get_entity asks Telegram
+        session = self.session(name)
+        try: entity = await BACKOFF.call(lambda: session.get_entity(chat_id), session=session)
+        except Exception: return False
+        return not isinstance(entity, (ChatForbidden, ChannelForbidden)) and not getattr(entity, "left", False)
+
+    async def assign_sources(self):
+        """Gives every indexed source exactly one listening session, replaying what a source missed if its listener changed."""
+        async with self.assigning:
+            stored = {normalize_chat_id(s): s for tasks in TASK_INDEX.values() for task in tasks for s in task.doc.get("source_ids", [])}
+            owners = {}
+            for key, chat_id in stored.items():
+                # Sources no session is a member of stay with the primary one
+                owners[key] = SESSION_NAME
+                for name in self.ring.walk(key) if self.extra else ():
+                    if await self.is_member(name, chat_id): owners[key] = name; break
+            moved = [key for key, name in owners.items() if self.owners.get(key, name) != name and not SOURCE_GAPS.get(key)]
+            states = []
+            if moved:
+                try: states = [state async for state in source_state_collection.find({"_id": {"$in": moved}})]
+                except Exception as e: LOGGER.error(f"Could not load high-water marks of {len(moved)} sources that changed listener: {e}")
+            # The new listener's first message ends each replay, so it is reset before the switch
+            for state in states: FIRST_LIVE_ID.pop(state["_id"], None); SOURCE_GAPS[state["_id"]] = [[state["last_message_id"], None]]
+            changed = owners != self.owners
+            self.owners = owners
+            self.listeners = {form: name for key, name in owners.items() if name != SESSION_NAME for form in chat_id_forms(stored[key])}
+            if states: spawn(catch_up(states))
+            if changed and self.extra:
+                counts = Counter(owners.values())
+                LOGGER.info("Source listeners: " + ", ".join(f"{name} {counts[name]}" for name in [SESSION_NAME, *self.extra]))
+
+    async def recheck(self):
+        # Leaving or losing access to a source sends no dependable update, so memberships are polled
+        while not self.stopping:
+            await asyncio.sleep(SESSION_CHECK_SECONDS)
+            try: await self.assign_sources()
+            except Exception as e: LOGGER.error(f"Source listener check failed: {e}")
+
+    async def watch_connection(self, name: str, session: TelegramClient):
+        # Telethon reconnects by itself; `disconnected` only completes once it has given up
+        await session.disconnected
+        if self.stopping or self.extra.get(name) is not session: return
+        LOGGER.error(f"Pool session {name} disconnected; its destinations and sources move to the rest of the pool.")
+        del self.extra[name]; self.ring = HashRing([SESSION_NAME, *self.extra], self.replicas)
+        try: await self.assign_sources()
+        except Exception as e: LOGGER.error(f"Reassigning the sources of {name} failed: {e}")
+
+    async def stop(self):
+        self.stopping = True
+        for session in self.extra.values(): await session.disconnect()
+
+POOL = SessionPool(SESSION_RING_REPLICAS)
+
+# --- Entity Cache ---
+# Chat titles for the settings menu are resolved concurrently (at most
+# ENTITY_CONCURRENCY get_entity calls at once) and kept for ENTITY_TTL_SECONDS,
+# so reopening the menu or pressing a toggle makes no API calls. Chats that
+# fail to resolve are retried after a minute.
+
+class EntityCache:
+    def __init__(self, ttl: float, concurrency: int):
+        self.ttl = ttl
+        self.entries: dict = {}  # chat_id -> (expires_at, title or None)
+        self.inflight: dict = {}
+        self.slots = asyncio.Semaphore(concurrency)
+
+    async def _resolve(self, chat_id) -> str | None:
+        try:
+            async with self.slots: entity = await BACKOFF.call(lambda: client.get_entity(chat_id))
+            title, ttl = getattr(entity, "title", None) or utils.get_display_name(entity) or None, self.ttl
+        except Exception as e:
+            LOGGER.warning(f"Could not resolve chat {chat_id}: {e}"); title, ttl = None, 60
+        finally:
+            self.inflight.pop(chat_id, None)
+        self.entries[chat_id] = (time.monotonic() + ttl, title)
+        return title
+
+    async def title(self, chat_id) -> str | None:
+        cached = self.entries.get(chat_id)
+        if cached and cached[0] > time.monotonic(): return cached[1]
+        if chat_id not in self.inflight: self.inflight[chat_id] = spawn(self._resolve(chat_id))
+        return await asyncio.shield(self.inflight[chat_id])
+
+    async def titles(self, ids: list) -> list:
+        return await asyncio.gather(*(self.title(chat_id) for chat_id in ids))
+
+ENTITIES = EntityCache(ENTITY_TTL_SECONDS, ENTITY_CONCURRENCY)
 
 # --- Telegram Bot (Controller) ---
 
@@ -225,7 +1671,7 @@ async def handle_new_message(event):
 
 async def forward_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, from_cancel=False):
     user_id = update.effective_user.id
-    tasks = list(tasks_collection.find({"owner_id": user_id}))
+    tasks = await tasks_collection.find({"owner_id": user_id}).to_list(None)
     buttons = []
     for t in tasks:
         status_emoji = '✅' if t.get('status') == 'active' else '❌'
@@ -251,10 +1697,11 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
     user_id = update.effective_user.id
     
     if action == "toggle_status":
-        task = tasks_collection.find_one({"_id": value, "owner_id": user_id})
+        task = await tasks_collection.find_one({"_id": value, "owner_id": user_id})
         if task:
             new_status = "stopped" if task.get('status') == 'active' else 'active'
-            tasks_collection.update_one({"_id": value}, {"$set": {"status": new_status}})
+            await tasks_collection.update_one({"_id": value}, {"$set": {"status": new_status}})
+            await task_changed(value)
             status_text = "▶️ activated" if new_status == "active" else "⏸️ paused"
             await query.answer(f"Task {status_text}!", show_alert=True)
         return await forward_command_handler(update, context)
@@ -263,16 +1710,25 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
         await query.edit_message_text(f"⚠️ Delete task '*{value}*'?\nThis cannot be undone.", reply_markup=keyboard, parse_mode='Markdown')
         return MAIN_MENU
     elif action == "delete_execute":
-        tasks_collection.delete_one({"_id": value, "owner_id": user_id})
-        stats_collection.delete_one({"task_id": value})
+        await tasks_collection.delete_one({"_id": value, "owner_id": user_id})
+        await stats_collection.delete_one({"task_id": value})
+        STATS.pending.pop(value, None)
+        await task_changed(value)
         await query.edit_text(f"✅ Task '*{value}*' deleted.", parse_mode='Markdown')
         await asyncio.sleep(2)
         return await forward_command_handler(update, context)
     elif action == "view_stats":
-        stats = stats_collection.find_one({"task_id": value})
+        await STATS.flush()
+        stats = await stats_collection.find_one({"task_id": value})
         if stats:
-            text = f"📊 *Stats: {value}*\n✅ Sent: {stats.get('total_forwarded', 0)}\n❌ Failed: {stats.get('total_failed', 0)}\n📅 Last: {stats.get('last_activity', 'Never')}"
+            text = f"📊 *Stats: {value}*\n✅ Sent: {stats.get('total_forwarded', 0)}\n❌ Failed: {stats.get('total_failed', 0)}\n♻️ Duplicates skipped: {stats.get('total_duplicates', 0)}\n📅 Last: {stats.get('last_activity', 'Never')}"
         else: text = f"📊 *Stats: {value}*\nNo activity yet."
+        counters = BACKOFF.counters
+        text += f"\n\n⏳ *Account throttling*\nFloodWaits: {counters['flood_waits']} ({counters['flood_seconds']:.0f}s)\nRetries: {counters['retries']} ({counters['retry_seconds']:.0f}s)\nGiven up: {counters['given_up']}"
+        text += f"\n🧬 Dedup index: {DEDUP.hits} hits, {DEDUP.misses} misses, {len(DEDUP.entries)} entries"
+        task_lines = [line for stage in ("filter", "deliver", "album_wait") if (line := format_quantiles(stage, value))]
+        shared_lines = [line for stage in ("route", "download", "thumbnail", "send", "flood_wait", "loop_lag") if (line := format_quantiles(stage))]
+        if task_lines or shared_lines: text += "\n\n⏱ *Latency p50 / p95 / p99*\n" + "\n".join(f"`{line}`" for line in task_lines + shared_lines)
         keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back", callback_data="back_to_main_menu")]])
         await query.edit_message_text(text, reply_markup=keyboard, parse_mode='Markdown')
         return MAIN_MENU
@@ -280,12 +1736,14 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
         return await forward_command_handler(update, context)
     elif action.startswith("settings_toggle"):
         task_id, filter_type = value.split(":")
-        task = tasks_collection.find_one({"_id": task_id, "owner_id": user_id})
+        task = await tasks_collection.find_one({"_id": task_id, "owner_id": user_id})
         if task:
             if "beautify" in action: db_field = "modifications.beautiful_captions"; current = task.get("modifications", {}).get("beautiful_captions", False)
             elif "blockme" in action: db_field = "settings.block_me"; current = task.get("settings", {}).get("block_me", False)
+            elif "copymode" in action: db_field = "settings.copy_mode"; current = task.get("settings", {}).get("copy_mode", COPY_MODE_DEFAULT)
             else: db_field = f"filters.{filter_type}"; current = task.get("filters", {}).get(filter_type, False)
-            tasks_collection.update_one({"_id": task_id}, {"$set": {db_field: not current}})
+            await tasks_collection.update_one({"_id": task_id}, {"$set": {db_field: not current}})
+            await task_changed(task_id)
         context.user_data['current_task_id'] = task_id
         return await show_settings_menu(update, context)
     elif action == "settings_menu":
@@ -293,17 +1751,12 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
         return await show_settings_menu(update, context)
 
 async def get_chat_titles(ids: list) -> str:
-    titles = []
-    for chat_id in ids:
-        try:
-            entity = await client.get_entity(chat_id)
-            titles.append(f"• {entity.title} (`{chat_id}`)")
-        except Exception: titles.append(f"• Unknown Chat (`{chat_id}`)")
-    return "\n".join(titles)
+    titles = await ENTITIES.titles(ids)
+    return "\n".join(f"• {title or 'Unknown Chat'} (`{chat_id}`)" for chat_id, title in zip(ids, titles))
 
 async def show_settings_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     task_id = context.user_data.get('current_task_id')
-    task = tasks_collection.find_one({"_id": task_id})
+    task = await tasks_collection.find_one({"_id": task_id})
     if not task: await update.callback_query.message.reply_text("❌ Error: Task not found."); return MAIN_MENU
 
     mods = task.get("modifications", {})
@@ -312,9 +1765,11 @@ async def show_settings_menu(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     beautify_emoji = "✅" if mods.get("beautiful_captions") else "❌"
     block_me_emoji = "✅" if settings.get("block_me", False) else "❌"
+    copy_mode_emoji = "✅" if settings.get("copy_mode", COPY_MODE_DEFAULT) else "❌"
     def f_emoji(f_type): return "✅" if filters_doc.get(f_type) else "❌"
 
-    text = f"⚙️ *Settings: {task_id}*\n\n📥 *Sources:*\n{await get_chat_titles(task.get('source_ids', []))}\n\n📤 *Destinations:*\n{await get_chat_titles(task.get('destination_ids', []))}\n\n⏱️ *Delay:* {settings.get('delay', 0)}s"
+    sources, destinations = await asyncio.gather(get_chat_titles(task.get('source_ids', [])), get_chat_titles(task.get('destination_ids', [])))
+    text = f"⚙️ *Settings: {task_id}*\n\n📥 *Sources:*\n{sources}\n\n📤 *Destinations:*\n{destinations}\n\n⏱️ *Delay:* {settings.get('delay', 0)}s"
 
     keyboard = InlineKeyboardMarkup([
         [InlineKeyboardButton(f"{f_emoji('block_photos')} Photos", callback_data=f"settings_toggle_filter:{task_id}:block_photos"), InlineKeyboardButton(f"{f_emoji('block_videos')} Videos", callback_data=f"settings_toggle_filter:{task_id}:block_videos")],
@@ -323,6 +1778,7 @@ async def show_settings_menu(update: Update, context: ContextTypes.DEFAULT_TYPE)
         [InlineKeyboardButton(f"{beautify_emoji} Beautiful Captions", callback_data=f"settings_toggle_beautify:{task_id}:_"), InlineKeyboardButton(f"{block_me_emoji} Block Me", callback_data=f"settings_toggle_blockme:{task_id}:_")],
         [InlineKeyboardButton("📝 Footer", callback_data="settings_edit_footer"), InlineKeyboardButton("🔄 Replace", callback_data="settings_edit_replace")],
         [InlineKeyboardButton("✂️ Remove Text", callback_data="settings_edit_remove"), InlineKeyboardButton("⏱️ Delay", callback_data="settings_edit_delay")],
+        [InlineKeyboardButton(f"{copy_mode_emoji} Copy Without Download", callback_data=f"settings_toggle_copymode:{task_id}:_")],
         [InlineKeyboardButton("⬅️ Back", callback_data="back_to_main_menu")]
     ])
     if update.callback_query: await update.callback_query.edit_message_text(text, reply_markup=keyboard, parse_mode='Markdown')
@@ -333,7 +1789,7 @@ async def new_task_start(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     await update.callback_query.edit_message_text("📝 Enter a unique name for this task.\nOr /cancel."); return ASK_LABEL
 async def get_label(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     label = update.message.text.strip()
-    if tasks_collection.find_one({"_id": label}): await update.message.reply_text("❌ Label exists. Choose another."); return ASK_LABEL
+    if await tasks_collection.find_one({"_id": label}): await update.message.reply_text("❌ Label exists. Choose another."); return ASK_LABEL
     context.user_data['new_task_label'] = label
     await update.message.reply_text("✅ Label set!\n📥 Send Source Chat ID(s)."); return ASK_SOURCE
 async def get_source(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -344,13 +1800,14 @@ async def get_source(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 async def get_destination(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     ids = [update.message.forward_origin.chat.id] if update.message.forward_origin else parse_chat_ids(update.message.text)
     if not ids: await update.message.reply_text("❌ Invalid ID."); return ASK_DESTINATION
-    tasks_collection.insert_one({
+    await tasks_collection.insert_one({
         "_id": context.user_data['new_task_label'], "owner_id": update.effective_user.id, "status": "active",
         "source_ids": context.user_data['new_task_source'], "destination_ids": ids,
         "modifications": {"footer_text": None, "replace_rules": None, "remove_texts": None, "beautiful_captions": False},
         "filters": {"blacklist_words": None, "whitelist_words": None, "block_photos": False, "block_videos": False, "block_documents": False, "block_text": False},
-        "settings": {"delay": 0, "block_me": False}, "created_at": datetime.utcnow()
+        "settings": {"delay": 0, "block_me": False, "copy_mode": COPY_MODE_DEFAULT}, "created_at": datetime.utcnow()
     })
+    await task_changed(context.user_data['new_task_label'])
     context.user_data.clear(); await update.message.reply_text("✅ Task created!"); await forward_command_handler(update, context); return ConversationHandler.END
 
 async def edit_setting_ask(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -371,7 +1828,7 @@ async def edit_setting_ask(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 
 async def save_setting_text(update: Update, context: ContextTypes.DEFAULT_TYPE, db_key_path: str):
     task_id = context.user_data.get('current_task_id'); user_text = update.message.text.strip()
-    task = tasks_collection.find_one({"_id": task_id})
+    task = await tasks_collection.find_one({"_id": task_id})
     
     if "footer_text" in db_key_path:
         new_value = None if user_text in ['/clear', '/skip'] else user_text
@@ -386,11 +1843,14 @@ async def save_setting_text(update: Update, context: ContextTypes.DEFAULT_TYPE,
             item = user_text[1:].strip()
             if item in current_lines: current_lines.remove(item); new_value = "\n".join(current_lines); msg = f"🗑️ Removed: '{item}'"
             else: new_value = "\n".join(current_lines); msg = f"❌ Not found: '{item}'"
+        elif db_key_path.endswith("_words") and any(len(line) > FILTER_WORD_MAX_CHARS for line in user_text.splitlines()):
+            new_value = "\n".join(current_lines); msg = f"❌ Too long: each word or phrase can have at most {FILTER_WORD_MAX_CHARS} characters."
         else:
             if user_text not in current_lines: current_lines.append(user_text); new_value = "\n".join(current_lines); msg = f"✅ Added: '{user_text}'"
             else: new_value = "\n".join(current_lines); msg = "⚠️ Exists."
 
-    tasks_collection.update_one({"_id": task_id}, {"$set": {db_key_path: new_value}})
+    await tasks_collection.update_one({"_id": task_id}, {"$set": {db_key_path: new_value}})
+    await task_changed(task_id)
     await update.message.reply_text(msg); await asyncio.sleep(1); return await show_settings_menu(update, context)
 
 async def get_footer(u, c): return await save_setting_text(u, c, "modifications.footer_text")
@@ -401,7 +1861,8 @@ async def get_whitelist(u, c): return await save_setting_text(u, c, "filters.whi
 async def get_delay(u, c):
     try:
         val = int(u.message.text.strip())
-        tasks_collection.update_one({"_id": c.user_data['current_task_id']}, {"$set": {"settings.delay": val}})
+        await tasks_collection.update_one({"_id": c.user_data['current_task_id']}, {"$set": {"settings.delay": val}})
+        await task_changed(c.user_data['current_task_id'])
         await u.message.reply_text(f"✅ Delay: {val}s")
     except: await u.message.reply_text("❌ Invalid number.")
     await asyncio.sleep(1); return await show_settings_menu(u, c)
@@ -409,6 +1870,126 @@ async def get_delay(u, c):
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data.clear(); await update.message.reply_text("❌ Cancelled."); await forward_command_handler(update, context, from_cancel=True); return ConversationHandler.END
 
+# --- Background Jobs ---
+# /batch, /clone and link saves run as tracked tasks outside the update handler,
+# at most JOBS_PER_USER at a time per user (the rest wait as "queued"). Jobs call
+# checkpoint() between messages, which is where a paused job waits; /jobs shows
+# progress, throughput and ETA and can pause, resume or cancel them.
+
+class BackgroundJob:
+    def __init__(self, job_id: int, owner_id: int, kind: str, label: str, message=None):
+        self.id, self.owner_id, self.kind, self.label, self.message = job_id, owner_id, kind, label, message
+        self.status, self.error = "queued", None
+        self.total, self.sent, self.failed, self.baseline = None, 0, 0, 0
+        self.started = self.finished = self.paused_at = None
+        self.paused_seconds = 0.0
+        self.resumed = asyncio.Event(); self.resumed.set()
+        self.task: asyncio.Task | None = None
+
+    @property
+    def active(self) -> bool:
+        return self.status in ("queued", "running", "paused")
+
+    def begin(self, total: int | None = None, handled: int = 0):
+        # `handled` is progress carried over from an earlier run; it doesn't count towards the rate
+        self.total, self.baseline = total, handled
+
+    def progress(self, sent: int, failed: int):
+        self.sent, self.failed = sent, failed
+
+    async def checkpoint(self):
+        await self.resumed.wait()
+
+    def pause(self):
+        if self.status == "running": self.status, self.paused_at = "paused", time.monotonic(); self.resumed.clear()
+
+    def resume(self):
+        if self.status == "paused":
+            self.paused_seconds += time.monotonic() - self.paused_at
+            self.status, self.paused_at = "running", None; self.resumed.set()
+
+    def rate(self) -> float:
+        if self.started is None: return 0.0
+        elapsed = (self.paused_at or self.finished or time.monotonic()) - self.started - self.paused_seconds
+        return (self.sent + self.failed - self.baseline) / elapsed if elapsed > 0 else 0.0
+
+    def describe(self) -> str:
+        icon = {"queued": "🕒", "running": "⏳", "paused": "⏸", "done": "✅", "failed": "❌", "cancelled": "🛑"}[self.status]
+        text = f"{icon} *#{self.id} {self.kind}* `{self.label}` — {self.status}\n{self.sent + self.failed}/{self.total or '?'} · ✅ {self.sent} ❌ {self.failed}"
+        rate = self.rate()
+        if rate: text += f" · ⚡ {rate:.1f} msg/s"
+        if self.active and rate and self.total: text += f" · ETA {format_duration(max(self.total - self.sent - self.failed, 0) / rate)}"
+        if self.error: text += f"\n`{self.error.replace('`', '')}`"
+        return text
+
+class JobManager:
+    def __init__(self, per_user: int, keep: int = 50):
+        self.per_user, self.keep = per_user, keep
+        self.jobs: OrderedDict[int, BackgroundJob] = OrderedDict()
+        self.slots: dict[int, asyncio.Semaphore] = {}
+        self.next_id = 1
+
+    def submit(self, owner_id: int, kind: str, label: str, run, message=None) -> BackgroundJob:
+        """Starts `run(job)` in the background; `message` is edited if the job fails or is cancelled."""
+        job = BackgroundJob(self.next_id, owner_id, kind, label, message)
+        self.next_id += 1
+        self.jobs[job.id] = job
+        for old in [j for j in self.jobs.values() if not j.active][:max(0, len(self.jobs) - self.keep)]: del self.jobs[old.id]
+        job.task = spawn(self._run(job, run))
+        return job
+
+    async def _run(self, job: BackgroundJob, run):
+        try:
+            async with self.slots.setdefault(job.owner_id, asyncio.Semaphore(self.per_user)):
+                job.status, job.started = "running", time.monotonic()
+                await run(job)
+            job.status = "done"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+        except Exception as e:
+            LOGGER.error(f"Job #{job.id} ({job.kind} {job.label}) failed: {e}")
+            job.status, job.error = "failed", str(e)
+        finally:
+            job.finished = time.monotonic(); job.resumed.set()
+        if job.message and job.status != "done":
+            try: await job.message.edit_text("🛑 Cancelled." if job.status == "cancelled" else f"❌ Error: {job.error}")
+            except Exception: pass
+
+    def find(self, kind: str, label: str) -> BackgroundJob | None:
+        return next((job for job in self.jobs.values() if job.active and job.kind == kind and job.label == label), None)
+
+    def for_user(self, owner_id: int) -> list[BackgroundJob]:
+        return [job for job in self.jobs.values() if job.owner_id == owner_id]
+
+JOBS = JobManager(JOBS_PER_USER)
+
+async def jobs_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await show_jobs(update, update.effective_user.id)
+    raise ApplicationHandlerStop  # not a reply to whatever conversation step is open
+
+async def show_jobs(update: Update, user_id: int):
+    jobs = JOBS.for_user(user_id)[-10:]
+    text = "\n\n".join(job.describe() for job in jobs) if jobs else "No background jobs."
+    buttons = [[InlineKeyboardButton(f"▶️ Resume #{job.id}" if job.status == "paused" else f"⏸ Pause #{job.id}", callback_data=f"job_{'resume' if job.status == 'paused' else 'pause'}:{job.id}"),
+                InlineKeyboardButton(f"✖️ Cancel #{job.id}", callback_data=f"job_cancel:{job.id}")] for job in jobs if job.active]
+    buttons.append([InlineKeyboardButton("🔄 Refresh", callback_data="job_refresh:0")])
+    if update.callback_query: await update.callback_query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(buttons), parse_mode='Markdown')
+    else: await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(buttons), parse_mode='Markdown')
+
+async def jobs_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query; await query.answer()
+    action, _, value = query.data.partition(':')
+    job = JOBS.jobs.get(int(value))
+    if job and job.owner_id == update.effective_user.id:
+        if action == "job_pause": job.pause()
+        elif action == "job_resume": job.resume()
+        elif action == "job_cancel" and job.active: job.task.cancel()
+        await asyncio.sleep(0)  # let a cancelled job record its status
+    try: await show_jobs(update, update.effective_user.id)
+    except Exception: pass  # "message is not modified"
+    # Job buttons can be pressed in any conversation state; keep them away from the menus' handlers
+    raise ApplicationHandlerStop
+
 # --- Batch & Clone ---
 async def batch_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await update.message.reply_text("📦 *Batch Mode*\nSend start and end links.\nExample:\n`https://t.me/channel/100`\n`https://t.me/channel/120`", parse_mode='Markdown'); return GET_LINKS
@@ -438,22 +2019,78 @@ async def get_batch_destination(update: Update, context: ContextTypes.DEFAULT_TY
     if not ids: await update.message.reply_text("❌ Invalid destination."); return GET_BATCH_DESTINATION
     info, dest = context.user_data['batch_info'], ids[0]
     status_msg = await update.message.reply_text(f"⏳ Batching {info['start_id']} -> {info['end_id']}...")
-    try:
-        msgs = await client.get_messages(info['channel_id'], ids=range(info['start_id'], info['end_id']+1))
-        valid_msgs = [m for m in msgs if m]
-        await status_msg.edit_text(f"✅ Found {len(valid_msgs)} messages. Processing...")
-        for m in valid_msgs:
-            if m.grouped_id: 
-                # Simple handling for batch albums: just send them. 
-                # (Full album logic is complex for batch, usually sending single is safer or using forward)
-                await process_single_message(dest, m, m.text) 
-            else:
-                await process_single_message(dest, m, m.text)
-            await asyncio.sleep(2)
-        await status_msg.edit_text("✅ Batch complete!")
-    except Exception as e: await status_msg.edit_text(f"❌ Error: {e}")
+    job = JOBS.submit(update.effective_user.id, "batch", f"{info['channel_id']}:{info['start_id']}-{info['end_id']} → {dest}",
+                      lambda tracker: run_batch(info['channel_id'], info['start_id'], info['end_id'], dest, status_msg, tracker), status_msg)
+    await update.message.reply_text(f"📋 Running as job #{job.id}. /jobs to follow, pause or cancel it.")
     return ConversationHandler.END
 
+async def run_batch(channel_id, start_id: int, end_id: int, dest_id: int, status_msg, tracker: BackgroundJob):
+    """Copies a message ID range in three stages: chunked fetch, up to BATCH_DOWNLOADS concurrent
+    downloads, and in-order sends. Album parts sharing a grouped_id go out as one album."""
+    tracker.begin(end_id - start_id + 1)
+    download_slots = asyncio.Semaphore(BATCH_DOWNLOADS)
+    units: asyncio.Queue = asyncio.Queue(maxsize=BATCH_DOWNLOADS * 2)  # bounds read-ahead (and disk use)
+
+    async def prepare(unit):
+        # Unprotected media is copied by reference and never takes a download slot
+        if len(unit) == 1 and can_copy_by_reference(unit[0]): return None, None, None, unit[0].media
+        if len(unit) > 1 and all(can_copy_by_reference(m) for m in unit): return await prepare_album(unit, copy=True)
+        async with download_slots:
+            return await (prepare_album(unit) if len(unit) > 1 else prepare_message(unit[0]))
+
+    async def emit(unit):
+        await units.put((unit, spawn(prepare(unit))))
+
+    async def fetch():
+        album = []
+        try:
+            for chunk_start in range(start_id, end_id + 1, BATCH_FETCH_CHUNK):
+                chunk = list(range(chunk_start, min(chunk_start + BATCH_FETCH_CHUNK, end_id + 1)))
+                for m in await BACKOFF.call(lambda: client.get_messages(channel_id, ids=chunk)):
+                    if not m or m.action: continue
+                    if album and m.grouped_id != album[0].grouped_id: await emit(album); album = []
+                    if m.grouped_id: album.append(m)
+                    else: await emit([m])
+            if album: await emit(album)
+        finally:
+            await units.put(None)
+
+    def discard(unit, preparing):
+        # Releases media for units prepared ahead but never sent (the job was cancelled)
+        def release(task):
+            if task.cancelled() or task.exception(): return
+            if len(unit) > 1:
+                for item in task.result()[0].values(): release_media(*item)
+            else: release_media(*task.result()[:3])
+        preparing.add_done_callback(release); preparing.cancel()
+
+    fetcher, sent, failed = spawn(fetch()), 0, 0
+    started, last_edit = time.monotonic(), time.monotonic()
+    try:
+        while (item := await units.get()) is not None:
+            unit, preparing = item
+            await tracker.checkpoint()
+            try:
+                prepared = await preparing
+                if len(unit) > 1:
+                    part_ids = [m.id for m in unit if m.id in prepared[1]]
+                    ok = await send_album(unit[0].grouped_id, [(None, dest_id, part_ids, next((m.text for m in unit if m.text), ""))], prepared, unit) > 0
+                else:
+                    ok = await fan_out_message(unit[0], [(dest_id, unit[0].text, None, 0.0)], prepared) > 0
+            except Exception as e:
+                LOGGER.error(f"Batch copy error for message {unit[0].id}: {e}"); ok = False
+            sent, failed = sent + len(unit) * ok, failed + len(unit) * (not ok)
+            tracker.progress(sent, failed)
+            if time.monotonic() - last_edit >= PROGRESS_EDIT_SECONDS:
+                last_edit = time.monotonic()
+                await status_msg.edit_text(f"⏳ Batching... {sent + failed} done\n✅ {sent} ❌ {failed}\n⚡ {tracker.rate():.1f} msg/s")
+        await fetcher  # surfaces fetch errors
+    finally:
+        fetcher.cancel()
+        while not units.empty():
+            if item := units.get_nowait(): discard(*item)
+    await status_msg.edit_text(f"✅ Batch complete!\nSent: {sent}\nFailed: {failed}")
+
 async def clone_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await update.message.reply_text("📋 *Clone Mode*\n📥 Send Source Channel ID.", parse_mode='Markdown'); return CLONE_SOURCE
 async def clone_get_source(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -479,42 +2116,115 @@ async def clone_process_skip(update: Update, context: ContextTypes.DEFAULT_TYPE)
 async def clone_execute(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     src, dst, restr = context.user_data['clone_source'], context.user_data['clone_dest'], context.user_data.get('clone_restricted', False)
     skips = set(context.user_data.get('clone_skip_ids', []))
-    msg = await update.message.reply_text("⏳ Fetching...")
-    try:
-        msgs = []
-        async for m in client.iter_messages(src):
-            if m.id not in skips: msgs.append(m)
-        msgs.reverse(); await msg.edit_text(f"✅ Cloning {len(msgs)} messages...")
-        for m in msgs:
-            try:
-                if restr: await process_single_message(dst, m, m.text)
-                else: await client.forward_messages(dst, m.id, src)
-                await asyncio.sleep(2)
-            except Exception as e: LOGGER.error(f"Clone err: {e}")
-        await msg.edit_text("✅ Done!")
-    except Exception as e: await msg.edit_text(f"❌ Error: {e}")
+    # One checkpoint document per source/destination pair, so re-running /clone resumes it
+    job_id = f"{src}:{dst}"
+    # A second run would start from the same checkpoint and send every message twice
+    running = JOBS.find("clone", job_id)
+    if running:
+        await update.message.reply_text(f"⚠️ This clone is already running as job #{running.id}. /jobs to follow, pause or cancel it.")
+        return ConversationHandler.END
+    job = await clone_jobs_collection.find_one({"_id": job_id}) or {"_id": job_id, "source_id": src, "dest_id": dst, "last_message_id": 0, "copied": 0, "failed": 0}
+    job.update(owner_id=update.effective_user.id, restricted=restr, skip_ids=sorted(skips | set(job.get("skip_ids", []))), status="running")
+    await clone_jobs_collection.replace_one({"_id": job_id}, job, upsert=True)
+    msg = await update.message.reply_text(f"⏳ Resuming after message {job['last_message_id']}..." if job['last_message_id'] else "⏳ Fetching...")
+    tracker = JOBS.submit(update.effective_user.id, "clone", job_id, lambda tracker: run_clone_job(job, msg, tracker), msg)
+    await update.message.reply_text(f"📋 Running as job #{tracker.id}. /jobs to follow, pause or cancel it.")
     return ConversationHandler.END
 
+async def run_clone_job(job: dict, msg, tracker: BackgroundJob):
+    """Copies the source oldest-first one page at a time, checkpointing the last handled message ID in `clone_jobs`."""
+    src, dst, restr = job["source_id"], job["dest_id"], job["restricted"]
+    skips, last_id = set(job.get("skip_ids", [])), job.get("last_message_id", 0)
+    copied, failed = job.get("copied", 0), job.get("failed", 0)
+    try:
+        total = (await BACKOFF.call(lambda: client.get_messages(src, limit=0))).total
+        tracker.begin(total, copied + failed); tracker.progress(copied, failed)
+        last_edit = 0.0
+        while True:
+            page = await BACKOFF.call(lambda: client.get_messages(src, limit=CLONE_PAGE_SIZE, min_id=last_id, reverse=True))
+            if not page: break
+            for m in page:
+                await tracker.checkpoint()
+                # Service messages (joins, pins, ...) can't be copied
+                if m.id not in skips and not m.action:
+                    try:
+                        if restr: ok = await process_single_message(dst, m, m.text)
+                        else: ok = await SCHEDULER.submit(dst, lambda session: session.forward_messages(dst, m.id, src), session=client) is not None
+                    except Exception as e:
+                        LOGGER.error(f"Clone err: {e}"); ok = False
+                    copied, failed = copied + ok, failed + (not ok)
+                last_id = m.id
+                tracker.progress(copied, failed)
+                await clone_jobs_collection.update_one({"_id": job["_id"]}, {"$set": {"last_message_id": last_id, "copied": copied, "failed": failed, "updated_at": datetime.utcnow()}})
+                if time.monotonic() - last_edit >= PROGRESS_EDIT_SECONDS:
+                    last_edit, rate = time.monotonic(), tracker.rate()
+                    remaining = max(total - copied - failed, 0)
+                    await msg.edit_text(f"⏳ Cloning... {copied + failed}/{total}\n✅ {copied} ❌ {failed}\n⚡ {rate:.1f} msg/s · ETA {format_duration(remaining / rate) if rate else '?'}")
+        await clone_jobs_collection.update_one({"_id": job["_id"]}, {"$set": {"status": "done"}})
+        await msg.edit_text(f"✅ Done! Copied {copied}, failed {failed}.")
+    except BaseException as e:
+        # Cancelled clones aren't resumed on restart; failed ones can be by running /clone again
+        await clone_jobs_collection.update_one({"_id": job["_id"]}, {"$set": {"status": "cancelled" if isinstance(e, asyncio.CancelledError) else "failed"}})
+        raise
+
 async def auto_save_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     m = re.match(r"https?://t\.me/(?:c/)?(\w+)/(\d+)", update.message.text)
     if not m: return
     chat_id_str, msg_id = m.groups()
     chat_id = int(f"-100{chat_id_str}") if chat_id_str.isdigit() else chat_id_str
+    user_id = update.effective_user.id
     status = await update.message.reply_text("⏳ Saving...")
-    try:
-        msg = await client.get_messages(chat_id, ids=int(msg_id))
+
+    async def save(tracker: BackgroundJob):
+        tracker.begin(1)
+        msg = await BACKOFF.call(lambda: client.get_messages(chat_id, ids=int(msg_id)))
         if not msg: await status.edit_text("❌ Not found."); return
-        await process_single_message(update.effective_user.id, msg, msg.text)
-        await status.edit_text("✅ Saved!")
-    except Exception as e: await status.edit_text(f"❌ Error: {e}")
+        ok = await process_single_message(user_id, msg, msg.text)
+        tracker.progress(int(ok), int(not ok))
+        await status.edit_text("✅ Saved!" if ok else "❌ Could not save.")
+    JOBS.submit(user_id, "save", f"{chat_id_str}/{msg_id}", save, status)
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("👋 *Welcome!*\n/forward - Tasks\n/batch - Batch Copy\n/clone - Clone Channel\n/help - Info", parse_mode='Markdown')
+    await update.message.reply_text("👋 *Welcome!*\n/forward - Tasks\n/batch - Batch Copy\n/clone - Clone Channel\n/jobs - Background Jobs\n/help - Info", parse_mode='Markdown')
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("📚 *Help*\n/forward - Create/Manage Tasks\n/batch - Copy range of messages\n/clone - Copy full channel", parse_mode='Markdown')
+    await update.message.reply_text("📚 *Help*\n/forward - Create/Manage Tasks\n/batch - Copy range of messages\n/clone - Copy full channel\n/jobs - Follow, pause or cancel running batches, clones and saves\n/profile <seconds> - Profile the bot (owner only)", parse_mode='Markdown')
+
+async def warm_up_entities(session=None):
+    """Makes sure `session` (the primary one by default) can resolve every chat active tasks use; see STARTUP_WARMUP."""
+    session = session or client
+    if STARTUP_WARMUP == "off": return
+    if STARTUP_WARMUP == "dialogs":
+        async def walk_all():
+            async for _ in session.iter_dialogs(): pass
+        return await BACKOFF.call(walk_all, session=session)
+    chat_ids = set()
+    async for doc in tasks_collection.find({"status": "active"}, {"source_ids": 1, "destination_ids": 1}):
+        chat_ids.update(doc.get("source_ids", []) + doc.get("destination_ids", []))
+    chat_ids = list(chat_ids)
+
+    async def in_session(chat_id) -> bool:
+        # Answered from the access hashes Telethon persists in the session file; only usernames cost an API call
+        try: await BACKOFF.call(lambda: session.get_input_entity(chat_id), session=session); return True
+        except Exception: return False
+
+    found = await asyncio.gather(*(in_session(chat_id) for chat_id in chat_ids))
+    # Anything the session doesn't know is looked for in the dialog list, walked only as far as needed
+    missing = {normalize_chat_id(chat_id) for chat_id, ok in zip(chat_ids, found) if not ok and isinstance(chat_id, int)}
+    async def walk_missing():
+        async for dialog in session.iter_dialogs():
+            missing.discard(normalize_chat_id(dialog.id))
+            if not missing: break
+    if missing: await BACKOFF.call(walk_missing, session=session)
+    LOGGER.info(f"Entity warm-up ({POOL.name(session)}): {len(chat_ids)} task chats, {found.count(False)} not in session, {len(missing)} unresolved.")
 
 async def main():
     global MY_ID
+    loaded = time.perf_counter()
+    metrics_server = None
+    if METRICS_PORT:
+        metrics_server = await asyncio.start_server(serve_metrics_request, METRICS_HOST, METRICS_PORT)
+        LOGGER.info(f"Metrics: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    # Updates are handled one at a time (ConversationHandler requires it); long work runs as background jobs
     application = Application.builder().token(BOT_TOKEN).build()
     cancel_handler = CommandHandler('cancel', cancel)
     
@@ -533,11 +2243,38 @@ async def main():
     batch_conv = ConversationHandler(entry_points=[CommandHandler('batch', batch_start)], states={GET_LINKS: [MessageHandler(filters.TEXT, get_links)], GET_BATCH_DESTINATION: [MessageHandler(filters.ALL, get_batch_destination)]}, fallbacks=[cancel_handler], allow_reentry=True)
     clone_conv = ConversationHandler(entry_points=[CommandHandler('clone', clone_start)], states={CLONE_SOURCE: [MessageHandler(filters.ALL, clone_get_source)], CLONE_DEST: [MessageHandler(filters.ALL, clone_get_dest)], CLONE_RESTRICTED: [CallbackQueryHandler(clone_set_restricted), MessageHandler(filters.TEXT, clone_process_skip)]}, fallbacks=[cancel_handler], allow_reentry=True)
 
+    application.add_handler(CommandHandler("profile", profile_command), group=-1)
+    application.add_handler(CommandHandler("jobs", jobs_command), group=-1); application.add_handler(CallbackQueryHandler(jobs_callback, pattern=r"^job_\w+:\d+$"), group=-1)
     application.add_handler(conv_handler); application.add_handler(batch_conv); application.add_handler(clone_conv)
     application.add_handler(MessageHandler(filters.Regex(r'https?://t\.me/') & filters.TEXT, auto_save_handler))
     application.add_handler(CommandHandler("start", start_command)); application.add_handler(CommandHandler("help", help_command))
 
+    await load_task_index()
+    SCHEDULER.start(); LOOP_MONITOR.start()
+    spawn(watch_task_changes()); spawn(STATS.run()); spawn(QUEUE.run()); spawn(QUEUE.dispatch())
+
     LOGGER.info("Bot starting..."); await application.initialize(); await application.start(); await application.updater.start_polling()
-    await client.start(); me = await client.get_me(); MY_ID = me.id; LOGGER.info(f"Telethon: {me.first_name}"); await client.run_until_disconnected(); await application.stop()
+    marks = await load_source_marks()
+    await BACKOFF.call(lambda: client.start()); me = await BACKOFF.call(client.get_me); connected = time.perf_counter()
+    try: await warm_up_entities()
+    except Exception as e: LOGGER.warning(f"Entity warm-up failed: {e}")
+    await POOL.start()
+    MY_ID = me.id; LOGGER.info(f"Telethon: {me.first_name}")
+    ready = time.perf_counter()
+    LOGGER.info(f"Startup: ready in {ready - STARTUP_BEGAN:.2f}s (module load {loaded - STARTUP_BEGAN:.2f}s, logins {connected - loaded:.2f}s, entity warm-up and session pool {ready - connected:.2f}s)")
+    spawn(QUEUE.recover()); spawn(catch_up(marks))
+    async for job in clone_jobs_collection.find({"status": "running"}):
+        try:
+            status = await application.bot.send_message(job["owner_id"], f"🔁 Resuming clone {job['source_id']} → {job['dest_id']} after message {job['last_message_id']}...")
+            JOBS.submit(job["owner_id"], "clone", job["_id"], lambda tracker, job=job, status=status: run_clone_job(job, status, tracker), status)
+        except Exception as e: LOGGER.error(f"Could not resume clone {job['_id']}: {e}")
+    # SIGTERM (service/container stop) and Ctrl-C disconnect the client, so the flushes below still run
+    for sig in (signal.SIGTERM, signal.SIGINT): asyncio.get_running_loop().add_signal_handler(sig, lambda: spawn(client.disconnect()))
+    try: await client.run_until_disconnected()
+    finally:
+        LOGGER.info("Shutting down: flushing queued jobs and stats...")
+        await QUEUE.flush(); await STATS.flush(); await POOL.stop()
+        await application.updater.stop(); await application.stop()
+        if metrics_server: metrics_server.close(); await metrics_server.wait_closed()
 
 if __name__ == "__main__": asyncio.run(main())
\ No newline at end of file